@@ -18,6 +18,6 @@
 
 import sys
 
-from blanco import main
+from blanco import run
 
-sys.exit(main())
+sys.exit(run())
@@ -0,0 +1,695 @@
+#
+"""_core - Sent mail parsing, contact handling and command line interface."""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import configparser
+import datetime
+import errno
+import operator
+import pathlib
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import formataddr
+from enum import Enum
+from types import ModuleType
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+try:
+    from importlib import resources
+except ImportError:  # pragma: no cover
+    import importlib_resources as resources
+
+import click
+
+try:
+    import notify2
+except ImportError:
+
+    class _Fake_Notify2(Enum):  # NOQA
+        URGENCY_CRITICAL = 2
+        URGENCY_NORMAL = 1
+        URGENCY_LOW = 0
+        EXPIRES_DEFAULT = -1
+        EXPIRES_NEVER = 0
+
+    notify2 = _Fake_Notify2  # NOQA
+
+from jnrbase import (colourise, human_time, xdg_basedir)
+
+from . import _report, _snapshot, _version
+from ._index import (SentIndex, header_cache_info)
+from ._sources import (Deadline, SentSource, available_sources,
+                       checkpoint_path, open_source, scan)
+# Re-exported for the package namespace
+from ._index import CompactIndex, decode_addresses, decode_date  # NOQA
+from ._index import header_cache_clear  # NOQA
+from ._sources import Capabilities, Position, SentRecord, load_source  # NOQA
+
+
+def read_sent(source: SentSource,
+              all_recipients: bool = False,
+              addresses: List[str] = None) -> SentIndex:
+    """Parse a sent source.
+
+    Args:
+        source: Sent source
+        all_recipients: Whether to include all recipients in results,
+            or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+
+    Returns:
+        Keys of email address, and values of seen date
+    """
+    return source.read(all_recipients, addresses)
+
+
+def _read_section(config: configparser.ConfigParser,
+                  section: str) -> Dict[str, Union[bool, int, str]]:
+    """Convert configuration section to options.
+
+    Args:
+        config: Configuration data
+        section: Section to read
+
+    Returns:
+        Parsed section
+    """
+    bool_keys = ['all', 'colour', 'gmail', 'notify', 'snapshot', 'verbose']
+    int_keys = ['read ahead', 'read ahead depth']
+    parsed = {}
+    for key in config[section]:
+        if key in bool_keys:
+            try:
+                parsed[key] = config.getboolean(section, key)
+            except ValueError:
+                raise ValueError(f'Config value for {key!r} must be a bool')
+        elif key in int_keys:
+            try:
+                parsed[key] = config.getint(section, key)
+            except ValueError:
+                raise ValueError(f'Config value for {key!r} must be an int')
+        else:
+            parsed[key] = config.get(section, key)
+    return parsed
+
+
+def process_config() -> Dict[str, Union[bool, int, str]]:
+    """Main configuration file.
+
+    Returns:
+        Parsed configuration file
+    """
+    conf_file = pathlib.Path(xdg_basedir.user_config('blanco')) / 'config.ini'
+    config = configparser.ConfigParser()
+    config.read_string(resources.read_text('blanco', 'config'), 'pkg config')
+    config.read(conf_file.as_posix())
+    return _read_section(config, 'blanco')
+
+
+def process_manifest(
+        manifest: pathlib.Path, defaults: Dict[str, Union[bool, int, str]]
+) -> Dict[str, Dict[str, Union[bool, int, str]]]:
+    """Batch manifest file.
+
+    Each section of the manifest is a profile, using the same keys as the main
+    configuration file.  Unset values are taken from ``defaults``.
+
+    Args:
+        manifest: Location of the manifest file
+        defaults: Values to use when unset in a profile
+
+    Returns:
+        Keys of profile name, and values of parsed profile
+
+    Raises:
+        ValueError: Unknown sent source type in profile
+    """
+    if not manifest.is_file():
+        raise IOError(f'Batch manifest ‘{manifest}’ not found')
+    # Paths and URLs, such as percent-encoded IMAP logins, are used verbatim
+    config = configparser.ConfigParser(
+        {k: str(v) for k, v in defaults.items()}, interpolation=None)
+    config.read(manifest.as_posix())
+    profiles = {}
+    for name in config.sections():
+        profiles[name] = _read_section(config, name)
+        if profiles[name]['sent type'] not in available_sources():
+            raise ValueError(f'Unknown sent type for profile {name!r}')
+    return profiles
+
+
+def show_note(notify: bool,
+              message: str,
+              contact: 'Contact',
+              urgency: int = notify2.URGENCY_NORMAL,
+              expires: int = notify2.EXPIRES_DEFAULT) -> None:
+    """Display reminder.
+
+    Args:
+        notify: Whether to use notification popup
+        message: Message string to show
+        contact: Contact to show message for
+        urgency: Urgency state for message
+        expires: Time to show notification popup in milliseconds
+
+    Raises
+        OSError: Failure to show notification
+    """
+    if notify:
+        if contact.image:
+            image = contact.image
+        else:
+            image = 'stock_person'
+        note = notify2.Notification('Hey, remember me?',
+                                    message.format(contact.notify_str()),
+                                    image)
+        note.set_urgency(urgency)
+        note.set_timeout(expires)
+
+        if not note.show():
+            raise OSError('Notification failed to display!')
+    else:
+        if urgency == notify2.URGENCY_CRITICAL:
+            colourise.pfail(message.format(contact.name))
+        else:
+            colourise.pwarn(message.format(contact.name))
+
+
+class Contact:
+    """Simple contact class."""
+
+    def __init__(self,
+                 name: str,
+                 addresses: Union[str, List[str]],
+                 frequency: int,
+                 image: Optional[str] = None):
+        """Initialise a new `Contact` object."""
+        self.name = name
+        if isinstance(addresses, str):
+            self.addresses = [
+                addresses.lower(),
+            ]
+        else:
+            self.addresses = [s.lower() for s in addresses]
+        self.frequency = frequency
+        self.image = image
+
+    def __repr__(self) -> str:
+        """Self-documenting string representation."""
+        return '{}({!r}, {!r}, {!r}, {!r})'.format(self.__class__.__name__,
+                                                   self.name, self.addresses,
+                                                   self.frequency, self.image)
+
+    def __str__(self) -> str:
+        """Pretty printed contact string."""
+        return '{} [{}] ({} days)'.format(self.name, ', '.join(self.addresses),
+                                          self.frequency)
+
+    def __format__(self, format_spec: str) -> str:
+        """Extended pretty printing for `Contact` strings.
+
+        Args:
+            format_spec: Coordinate formatting system to use
+
+        Returns:
+            Human readable string representation of `Contact` object
+
+        Raises:
+            ValueError: Unknown value for ``format_spec``
+        """
+        if not format_spec:  # default format calls set format_spec to ''
+            return str(self)
+        elif format_spec == 'email':
+            return formataddr((self.name, self.addresses[0]))
+        else:
+            raise ValueError(f'Unknown format_spec {format_spec!r}')
+
+    def trigger(self, sent: Dict[str, datetime.datetime]) -> datetime.datetime:
+        """Calculate trigger date for contact.
+
+        Args:
+            sent: Address to last seen dictionary
+
+        Returns:
+            Date to start reminders on
+        """
+        match = sorted([sent[k] for k in self.addresses if k in sent])[0]
+        return match + datetime.timedelta(days=self.frequency)
+
+    def notify_str(self) -> str:
+        """Calculate trigger date for contact.
+
+        Returns:
+            Stylised name for use with notifications
+        """
+        if 'body-hyperlinks' in notify2.get_server_caps():
+            name = f"<a href='mailto:{self.addresses[0]}'>{self.name}</a>"
+        else:
+            name = self.name
+        return name
+
+
+class Contacts(list):
+    """Group of `Contact`."""
+
+    def __init__(self, contacts: Optional[Contact] = None):
+        """Initialise a new `Contacts` object."""
+        super(Contacts, self).__init__()
+        if contacts:
+            self.extend(contacts)
+
+    def __repr__(self) -> str:
+        """Self-documenting string representation."""
+        return '{}({!r})'.format(
+            self.__class__.__name__,
+            sorted(self[:], key=operator.attrgetter('name')))
+
+    def addresses(self) -> List[str]:
+        """Fetch all addresses of all `Contact` objects.
+
+        Returns:
+            Addresses of every `Contact`
+        """
+        return [address for contact in self for address in contact.addresses]
+
+    def parse(self, addressbook: pathlib.Path, field: str) -> None:
+        """Parse address book for usable entries.
+
+        Args:
+            addressbook: Location of the address book to useful
+            field: Address book field to use for contact frequency
+        """
+        if not addressbook.is_file():
+            raise IOError(f'Addressbook file not found {addressbook!r}')
+        config = configparser.ConfigParser()
+        config.read(addressbook.as_posix())
+
+        for entry in config.values():
+            if field not in entry:
+                continue
+            self.append(
+                Contact(entry.get('name'), entry.get('email'),
+                        human_time.parse_timedelta(entry.get(field)).days,
+                        entry.get('image')))
+
+
+def contact_status(contact: Contact,
+                   sent: Dict[str, datetime.datetime],
+                   now: datetime.date,
+                   complete: bool = True
+                   ) -> Tuple[str, Optional[datetime.date]]:
+    """Work out whether mail is due for a contact.
+
+    With incomplete results, from a scan that stopped at its deadline, a
+    contact is only resolved if any address seen already makes it due or all
+    its addresses have been seen.  The trigger date is the earliest across
+    a contact’s addresses, so unseen addresses can only bring it forward.
+
+    Args:
+        contact: Contact to check
+        sent: Address to last seen dictionary
+        now: Date to check against
+        complete: Whether ``sent`` covers all sent mail
+
+    Returns:
+        Status of ``due``, ``pending``, ``missing`` or ``unknown``, and trigger
+        date if known
+    """
+    seen = [address for address in contact.addresses if address in sent]
+    if seen:
+        trigger = contact.trigger(sent)
+        if now > trigger:
+            return 'due', trigger
+        elif complete or len(seen) == len(contact.addresses):
+            return 'pending', trigger
+    elif complete:
+        return 'missing', None
+    return 'unknown', None
+
+
+def check_contacts(
+        contacts: Contacts,
+        sent: Dict[str, datetime.datetime],
+        notify: bool,
+        complete: bool = True) -> Tuple[int, int, List[datetime.datetime]]:
+    """Display reminders for contacts.
+
+    Args:
+        contacts: Contacts to check
+        sent: Address to last seen dictionary
+        notify: Whether to use notification popups
+        complete: Whether ``sent`` covers all sent mail, see
+            :func:`contact_status`
+
+    Returns:
+        Number of contacts with mail due, number of contacts with no mail
+        record, and trigger dates for contacts not yet due
+    """
+    now = datetime.datetime.utcnow().date()
+    due = missing = 0
+    pending = []
+    for contact in contacts:
+        status, trigger = contact_status(contact, sent, now, complete)
+        if status == 'missing':
+            missing += 1
+            show_note(notify, 'No mail record for {}', contact)
+        elif status == 'due':
+            due += 1
+            show_note(notify, 'Mail due for {}', contact,
+                      notify2.URGENCY_CRITICAL, notify2.EXPIRES_NEVER)
+        elif status == 'pending':
+            pending.append(trigger)
+        else:
+            show_note(notify, 'Unknown (scan incomplete) for {}', contact,
+                      notify2.URGENCY_LOW)
+    return due, missing, pending
+
+
+def contact_reports(contacts: Contacts,
+                    sent: Dict[str, datetime.datetime],
+                    complete: bool = True
+                    ) -> Iterator[_report.ContactReport]:
+    """Check contacts for machine-readable reports.
+
+    Args:
+        contacts: Contacts to check
+        sent: Address to last seen dictionary
+        complete: Whether ``sent`` covers all sent mail, see
+            :func:`contact_status`
+
+    Yields:
+        Contact reports, in addressbook order
+    """
+    now = datetime.datetime.utcnow().date()
+    for contact in contacts:
+        status, trigger = contact_status(contact, sent, now, complete)
+        if trigger:
+            # Matches Contact.trigger, so the two dates always agree
+            last_sent = min(sent[address] for address in contact.addresses
+                            if address in sent)
+            days_overdue = (now - trigger).days
+        else:
+            last_sent = days_overdue = None
+        yield _report.ContactReport(contact.name, tuple(contact.addresses),
+                                    last_sent, trigger, days_overdue, status)
+
+
+def run_batch(profiles: Dict[str, Dict[str, Union[bool, int, str]]],
+              notify: bool,
+              snapshot: bool = False,
+              jobs: Optional[int] = None) -> Optional[int]:
+    """Check contacts for several profiles in one process.
+
+    Sent sources are parsed on a shared pool of worker processes, largest
+    first so that a big source runs alongside the small ones instead of after
+    them.  Profiles that share a sent source reuse a single parse result.
+
+    Args:
+        profiles: Keys of profile name, and values of parsed profile
+        notify: Whether to use notification popups
+        snapshot: Whether to write a status snapshot for all profiles
+        jobs: Number of worker processes, number of CPUs if not specified
+
+    Returns:
+        Exit code on failure
+    """
+    books = {}
+    shared = {}
+    for name, profile in profiles.items():
+        books[name] = Contacts()
+        books[name].parse(
+            pathlib.Path(profile['addressbook']).expanduser(),
+            profile['field'])
+        source = open_source(profile['sent type'], profile)
+        # Options that only tune I/O, such as read-ahead, don’t separate
+        # otherwise identical sources; the first profile’s settings are used
+        key = source.identity() + (profile['all'], )
+        shared.setdefault(key, (source, []))[1].append(name)
+
+    code = None
+    due = missing = 0
+    pending = []
+    with ProcessPoolExecutor(jobs) as pool:
+        results = {}
+        for key in sorted(shared, key=lambda k: shared[k][0].size(),
+                          reverse=True):
+            source, names = shared[key]
+            addresses = {
+                address
+                for name in names
+                for address in books[name].addresses()
+            }
+            all_recipients = key[-1]
+            future = pool.submit(read_sent, source, all_recipients, addresses)
+            results.update((name, future) for name in names)
+
+        for name in profiles:
+            # Reminders are written to stderr, so keep headings with them
+            click.echo(colourise.info(f'{name}:'), err=True)
+            try:
+                sent = results[name].result()
+            except (IOError, ValueError) as e:
+                # Report each broken profile, but keep checking the others
+                colourise.pfail(e.args[0])
+                code = errno.EPERM
+                continue
+            counts = check_contacts(books[name], sent, notify)
+            due += counts[0]
+            missing += counts[1]
+            pending.extend(counts[2])
+
+    # A failed profile would be left out of the counts, without the snapshot
+    # being marked as stale
+    if snapshot and code is None:
+        sources = [pathlib.Path(p['addressbook']).expanduser()
+                   for p in profiles.values()]
+        sources.extend(source.changes_path()
+                       for source, _ in shared.values())
+        _snapshot.write(_snapshot.snapshot_path(), due, missing, pending,
+                        sources)
+    return code
+
+
+class _SourceChoice(click.Choice):
+    """Sent source type choice, with installed backends found on first use.
+
+    Reading package metadata is slow, so it is left until an option value is
+    checked or help is shown, rather than paid for on every import.
+    """
+
+    def __init__(self):
+        """Initialise a new `_SourceChoice` object."""
+        self._choices: Optional[Tuple[str, ...]] = None
+        self.case_sensitive = True
+
+    @property
+    def choices(self) -> Tuple[str, ...]:
+        """Installed sent source types."""
+        if self._choices is None:
+            self._choices = tuple(sorted(available_sources()))
+        return self._choices
+
+
+CONFIG_DATA: Dict[str, Union[bool, int, str]] = process_config()
+
+
+@click.command(help='Check sent mail to make sure you’re keeping in contact '
+               'with your friends.',
+               epilog='Please report bugs to jnrowe@gmail.com')
+@click.option('-a',
+              '--addressbook',
+              type=pathlib.Path,
+              metavar='FILENAME',
+              default=CONFIG_DATA['addressbook'],
+              help='Address book to read contacts from.')
+@click.option('-t',
+              '--sent-type',
+              type=_SourceChoice(),
+              default=CONFIG_DATA['sent type'],
+              help='Sent source type.')
+@click.option('-r',
+              '--all/--no-all',
+              default=CONFIG_DATA['all'],
+              help='Include all recipients(CC and BCC fields).')
+@click.option('-m',
+              '--mbox',
+              type=pathlib.Path,
+              metavar='FILENAME',
+              default=CONFIG_DATA['mbox'],
+              help='Mailbox used to store sent mail.')
+@click.option('--mh-sequence',
+              metavar='NAME',
+              default=CONFIG_DATA['mh sequence'],
+              help='MH sequence for tracking messages already recorded.')
+@click.option('--read-ahead',
+              metavar='N',
+              type=click.IntRange(0),
+              default=CONFIG_DATA['read ahead'],
+              help='Threads for reading maildir and MH messages ahead.')
+@click.option('--read-ahead-depth',
+              metavar='N',
+              type=click.IntRange(0),
+              default=CONFIG_DATA['read ahead depth'],
+              help='Maximum number of messages to read ahead.')
+@click.option('--deadline',
+              metavar='SECONDS',
+              type=click.FloatRange(0),
+              help='Stop reading sent mail after this many seconds.')
+@click.option('-l',
+              '--log',
+              type=pathlib.Path,
+              metavar='FILENAME',
+              default=CONFIG_DATA['log'],
+              help='msmtp log to parse.')
+@click.option('-i',
+              '--imap',
+              metavar='URL',
+              default=CONFIG_DATA['imap'],
+              help='IMAP folder used to store sent mail.')
+@click.option('-g',
+              '--gmail/--no-gmail',
+              default=CONFIG_DATA['gmail'],
+              help='Log from a gmail account(use accurate filter).')
+@click.option('-s',
+              '--field',
+              default=CONFIG_DATA['field'],
+              help='Addressbook field to use for frequency value.')
+@click.option('-n',
+              '--notify/--no-notify',
+              default=CONFIG_DATA['notify'],
+              help='Display reminders using notification popups.')
+@click.option('--colour/--no-colour',
+              envvar='BLANCO_COLOUR',
+              default=CONFIG_DATA['colour'],
+              help='Output colourised informational text.')
+@click.option('-f',
+              '--format',
+              'output_format',
+              type=click.Choice(_report.FORMATS),
+              help='Write a machine-readable report instead of reminders.')
+@click.option('--snapshot/--no-snapshot',
+              default=CONFIG_DATA['snapshot'],
+              help='Write status snapshot for use with --status.')
+@click.option('--status',
+              is_flag=True,
+              help='Report number of contacts due from snapshot and exit.')
+@click.option('-b',
+              '--batch',
+              type=pathlib.Path,
+              metavar='FILENAME',
+              help='Manifest of profiles to check in a single run.')
+@click.option('-j',
+              '--jobs',
+              type=click.IntRange(1),
+              metavar='N',
+              help='Number of worker processes for --batch.')
+@click.option('-v', '--verbose/--no-verbose', help='Produce verbose output.')
+@click.version_option(_version.dotted)
+def main(addressbook: pathlib.Path, sent_type: str, all: bool,
+         mbox: pathlib.Path, mh_sequence: str, read_ahead: int,
+         read_ahead_depth: int, deadline: Optional[float], log: pathlib.Path,
+         imap: str, gmail: bool,
+         field: str, notify: bool, colour: bool,
+         output_format: Optional[str], snapshot: bool,
+         status: bool, batch: Optional[pathlib.Path], jobs: Optional[int],
+         verbose: bool) -> Optional[int]:  # pragma: no cover
+    """Main script."""
+    if status:
+        return _snapshot.report()
+
+    colourise.COLOUR = colour
+
+    if notify and type(notify2) != ModuleType:
+        raise click.UsageError(
+            colourise.fail(
+                'Notification popups require the notify2 package\n'))
+
+    if notify:
+        if not notify2.init(sys.argv[0]):
+            colourise.pfail('Unable to initialise notify2!')
+            return errno.EIO
+
+    # Start from the configuration file, so that backends can read their own
+    # settings
+    options = dict(CONFIG_DATA)
+    options.update({
+        'addressbook': addressbook,
+        'sent type': sent_type,
+        'all': all,
+        'mbox': mbox,
+        'mh sequence': mh_sequence,
+        'read ahead': read_ahead,
+        'read ahead depth': read_ahead_depth,
+        'log': log,
+        'imap': imap,
+        'gmail': gmail,
+        'field': field,
+    })
+    if batch:
+        if deadline is not None:
+            raise click.UsageError('--deadline can’t be used with --batch')
+        if output_format:
+            raise click.UsageError('--format can’t be used with --batch')
+        try:
+            profiles = process_manifest(batch.expanduser(), options)
+            return run_batch(profiles, notify, snapshot, jobs)
+        except IOError as e:
+            colourise.pfail(e.args[0])
+            return errno.EPERM
+
+    source = open_source(sent_type, options)
+    if read_ahead and not source.capabilities.parallel:
+        colourise.pwarn(f'Read-ahead is not supported by {sent_type} sources')
+    contacts = Contacts()
+    contacts.parse(addressbook.expanduser(), field)
+    if deadline is not None and not source.capabilities.bounded:
+        colourise.pwarn(f'Deadlines are not supported by {sent_type} sources')
+        deadline = None
+    addresses = contacts.addresses()
+    try:
+        if deadline is None:
+            sent = read_sent(source, all, addresses)
+            complete = True
+        else:
+            budget = Deadline(deadline)
+            sent = scan(source, all, addresses, budget,
+                        checkpoint_path(source, all, addresses))
+            complete = not budget.expired
+    except IOError as e:
+        colourise.pfail(e.args[0])
+        return errno.EPERM
+    if verbose:
+        for name, info in header_cache_info().items():
+            click.echo(f'Header {name} cache: {info.hits} hits, '
+                       f'{info.misses} misses', err=True)
+
+    if output_format:
+        summary = _report.write(contact_reports(contacts, sent, complete),
+                                output_format, sys.stdout.buffer)
+        due = len(summary.get('due', []))
+        missing = len(summary.get('missing', []))
+        pending = summary.get('pending', [])
+    else:
+        due, missing, pending = check_contacts(contacts, sent, notify,
+                                               complete)
+
+    # Partial results would make the snapshot report unresolved contacts as
+    # neither due nor missing
+    if snapshot and complete:
+        _snapshot.write(_snapshot.snapshot_path(), due, missing, pending,
+                        [addressbook.expanduser(), source.changes_path()])
@@ -0,0 +1,265 @@
+#
+"""_imap - IMAP sent folder support."""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import imaplib
+import netrc
+import os
+import pathlib
+import sys
+
+from email.parser import BytesHeaderParser
+from typing import Dict, Iterator, List, Tuple, Union
+from urllib.parse import (unquote, urlsplit)
+
+from jnrbase import xdg_basedir
+
+from ._index import (SentIndex, load_state, record_message, save_state)
+from ._sources import (Capabilities, SentRecord, SentSource, address_filter)
+
+#: Number of messages to request with each ``UID FETCH`` command
+BATCH_SIZE = 1000
+
+#: Message data to fetch, ``PEEK`` keeps the server from setting ``\Seen``
+FETCH_ITEMS = '(BODY.PEEK[HEADER.FIELDS (TO CC BCC DATE)])'
+
+
+def state_path(url: str) -> pathlib.Path:
+    """Location of the synchronisation state for an IMAP folder.
+
+    Args:
+        url: IMAP folder URL
+
+    Returns:
+        State file path
+    """
+    parts = urlsplit(url)
+    key = f'{parts.username}@{parts.hostname}:{parts.port}{parts.path}'
+    return pathlib.Path(xdg_basedir.user_cache('blanco')) / 'imap' \
+        / hashlib.sha1(key.encode()).hexdigest()
+
+
+def uid_set(uids: List[int]) -> str:
+    """Format UIDs as a compact IMAP sequence set.
+
+    Args:
+        uids: Ascending message UIDs
+
+    Returns:
+        Sequence set with consecutive runs collapsed to ranges
+    """
+    ranges = []
+    start = prev = uids[0]
+    for uid in uids[1:]:
+        if uid != prev + 1:
+            ranges.append((start, prev))
+            start = uid
+        prev = uid
+    ranges.append((start, prev))
+    return ','.join(str(a) if a == b else f'{a}:{b}' for a, b in ranges)
+
+
+def _connect(url: str) -> Tuple[imaplib.IMAP4, str]:
+    """Open an authenticated connection to an IMAP server.
+
+    Passwords are taken from the URL, or from :file:`~/.netrc` if not
+    specified.
+
+    Args:
+        url: IMAP folder URL, for example ``imaps://user@host/Sent``
+
+    Returns:
+        Server connection, and folder name
+
+    Raises:
+        IOError: Unsupported URL, no password available, or connection
+            failure
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('imap', 'imaps') or not parts.hostname:
+        raise IOError(f'Unsupported IMAP URL ‘{url}’')
+    host = parts.hostname
+    user = unquote(parts.username or os.getenv('USER', ''))
+    password = unquote(parts.password or '')
+    if not password:
+        try:
+            auth = netrc.netrc().authenticators(host)
+        except (FileNotFoundError, netrc.NetrcParseError):
+            auth = None
+        if not auth:
+            raise IOError(f'No IMAP password found for ‘{host}’')
+        user = auth[0] or user
+        password = auth[2]
+    folder = unquote(parts.path.lstrip('/')) or 'Sent'
+
+    cls = imaplib.IMAP4_SSL if parts.scheme == 'imaps' else imaplib.IMAP4
+    try:
+        conn = cls(host, parts.port or cls.port)
+    except OSError as e:
+        raise IOError(f'Unable to connect to IMAP server ‘{host}’') from e
+    try:
+        conn.login(user, password)
+    except imaplib.IMAP4.error as e:
+        conn.logout()
+        raise IOError(f'IMAP login failed for ‘{host}’') from e
+    return conn, folder
+
+
+def sync(url: str, state_file: pathlib.Path = None) -> Dict:
+    """Synchronise recipient data from an IMAP folder.
+
+    Only messages added since the previous run are fetched, unless the
+    folder’s ``UIDVALIDITY`` has changed.  Headers are fetched in batches of
+    :data:`BATCH_SIZE` over a single connection.
+
+    Args:
+        url: IMAP folder URL
+        state_file: Location of synchronisation state, default location if
+            not specified
+
+    Returns:
+        Synchronisation state
+    """
+    if not state_file:
+        state_file = state_path(url)
+    state = load_state(state_file)
+
+    conn, folder = _connect(url)
+    quoted = '"{}"'.format(folder.replace('\\', '\\\\').replace('"', '\\"'))
+    try:
+        typ, _ = conn.select(quoted, readonly=True)
+        if typ != 'OK':
+            raise IOError(f'IMAP folder ‘{folder}’ not found')
+        _, data = conn.response('UIDVALIDITY')
+        uidvalidity = int(data[0])
+        if not state or state['uidvalidity'] != uidvalidity:
+            state = {
+                'uidvalidity': uidvalidity,
+                'uid': 0,
+                'to': SentIndex(),
+                'all': SentIndex(),
+            }
+
+        _, data = conn.uid('SEARCH', f"UID {state['uid'] + 1}:*")
+        # n:* always matches the newest message, even if its UID is below n
+        uids = sorted(u for u in map(int, (data[0] or b'').split())
+                      if u > state['uid'])
+        parser = BytesHeaderParser()
+        for start in range(0, len(uids), BATCH_SIZE):
+            _, data = conn.uid('FETCH',
+                               uid_set(uids[start:start + BATCH_SIZE]),
+                               FETCH_ITEMS)
+            for item in data:
+                if isinstance(item, tuple):
+                    record_message(state, parser.parsebytes(item[1]))
+        if uids:
+            state['uid'] = uids[-1]
+    except imaplib.IMAP4.error as e:
+        raise IOError(f'IMAP failure reading ‘{folder}’') from e
+    finally:
+        conn.logout()
+
+    save_state(state_file, state)
+    return state
+
+
+def parse_imap(url: str,
+               all_recipients: bool = False,
+               addresses: List[str] = None,
+               state_file: pathlib.Path = None) -> SentIndex:
+    """Parse IMAP sent folder for contact details.
+
+    Args:
+        url: IMAP folder URL, for example ``imaps://user@host/Sent``
+        all_recipients: Whether to include CC and BCC addresses in
+            results, or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        state_file: Location of synchronisation state, default location if
+            not specified
+
+    Returns:
+        Keys of email address, and values of seen date
+    """
+    state = sync(url, state_file)
+    seen = state['all' if all_recipients else 'to']
+    wanted = address_filter(addresses)
+    return seen.subset(wanted) if wanted else seen
+
+
+class IMAPSource(SentSource):
+    """Sent mail stored in an IMAP folder.
+
+    Only aggregated data is kept between runs, so records are produced
+    without a position, one per address.
+    """
+
+    location_key = 'imap'
+    capabilities = Capabilities(incremental=True)
+
+    @classmethod
+    def from_options(cls, options: Dict[str, Union[bool, int, str]]
+                     ) -> 'IMAPSource':
+        """Create a source from configuration options.
+
+        Args:
+            options: Configuration, or command line, options
+
+        Returns:
+            IMAP sent source
+        """
+        return cls(options[cls.location_key], options)
+
+    def size(self) -> int:
+        """Estimate the amount of work needed to read the source.
+
+        Remote sources are latency bound, so they should always be started
+        first.
+
+        Returns:
+            Largest possible size
+        """
+        return sys.maxsize
+
+    def changes_path(self) -> pathlib.Path:
+        """Find the local file that changes along with the source.
+
+        Returns:
+            Synchronisation state location
+        """
+        return state_path(self.location)
+
+    def records(self,
+                all_recipients: bool = False,
+                addresses: List[str] = None) -> Iterator[SentRecord]:
+        """Iterate over recipients in the folder.
+
+        See :func:`parse_imap`.
+        """
+        seen = self.read(all_recipients, addresses)
+        return (SentRecord(address, date, None)
+                for address, date in seen.items())
+
+    def read(self,
+             all_recipients: bool = False,
+             addresses: List[str] = None) -> SentIndex:
+        """Read the folder in to an index.
+
+        See :func:`parse_imap`.
+        """
+        return parse_imap(self.location, all_recipients, addresses)
@@ -0,0 +1,595 @@
+#
+"""_index - Aggregated sent mail data."""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import datetime
+import json
+import mmap
+import os
+import pathlib
+import re
+import tempfile
+import zlib
+
+from array import array
+from collections.abc import Mapping
+from email.message import Message
+from email.utils import (getaddresses, parsedate)
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Union
+
+#: Number of distinct header values to remember decoded results for
+HEADER_CACHE_SIZE = 4096
+
+#: Time of day in a ``Date`` header, along with any zone and comment
+_HEADER_TIME = re.compile(
+    r'\s\d{1,2}:\d{2}(?::\d{2})?(?:\s*(?:[+-]\d{4}|[A-Za-z]{1,5})(?!\w))?'
+    r'(?:\s*\(.*\))?')
+
+
+class SentIndex(Mapping):
+    """Latest sent date for each address.
+
+    Records are aggregated as they are added, so memory use grows with the
+    number of unique addresses rather than the number of messages.  Indexes
+    built from separate sources, or from shards of a single source, can be
+    combined with :meth:`merge`.
+
+    Lookups behave like a read-only :obj:`dict` of address to
+    :class:`datetime.date`.
+    """
+
+    def __init__(self,
+                 dates: Optional[Mapping[str, datetime.date]] = None):
+        """Initialise a new `SentIndex` object."""
+        self._dates: Dict[str, int] = {}
+        if dates:
+            for address, date in dates.items():
+                self.update(address, date)
+
+    def __repr__(self) -> str:
+        """Self-documenting string representation."""
+        return '{}({!r})'.format(self.__class__.__name__, dict(self.items()))
+
+    def __getitem__(self, address: str) -> datetime.date:
+        """Fetch latest sent date for address."""
+        return datetime.date.fromordinal(self._dates[address])
+
+    def __contains__(self, address: object) -> bool:
+        """Check whether mail has been sent to address."""
+        return address in self._dates
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over addresses."""
+        return iter(self._dates)
+
+    def __len__(self) -> int:
+        """Number of addresses."""
+        return len(self._dates)
+
+    def update(self, address: str, date: datetime.date) -> None:
+        """Record mail sent to an address.
+
+        Args:
+            address: Recipient address
+            date: Date mail was sent
+        """
+        ordinal = date.toordinal()
+        if ordinal > self._dates.get(address, 0):
+            self._dates[address] = ordinal
+
+    def merge(self, other: 'SentIndex') -> 'SentIndex':
+        """Combine with another index, keeping the latest dates.
+
+        Merging is associative and commutative, so indexes can be combined in
+        any order.
+
+        Args:
+            other: Index to merge in to this one
+
+        Returns:
+            This index, to allow chaining
+        """
+        dates = self._dates
+        for address, ordinal in other.ordinals():
+            if ordinal > dates.get(address, 0):
+                dates[address] = ordinal
+        return self
+
+    def subset(self, addresses: Iterable[str]) -> 'SentIndex':
+        """Extract the data for some addresses.
+
+        Args:
+            addresses: Addresses to include
+
+        Returns:
+            New index containing only the given addresses
+        """
+        index = self.__class__()
+        index._dates = {
+            address: self._dates[address]
+            for address in set(addresses) if address in self._dates
+        }
+        return index
+
+    def ordinals(self) -> Iterable[Tuple[str, int]]:
+        """Iterate over addresses and latest sent day ordinals.
+
+        Returns:
+            Address and :meth:`datetime.date.toordinal` pairs
+        """
+        return self._dates.items()
+
+    def dumps(self) -> str:
+        """Serialise index.
+
+        Returns:
+            Compact line-based representation
+        """
+        return '\n'.join(f'{ordinal} {address}'
+                         for address, ordinal in sorted(self.ordinals()))
+
+    @classmethod
+    def loads(cls, data: str) -> 'SentIndex':
+        """Deserialise index.
+
+        Args:
+            data: Output from :meth:`dumps`
+
+        Returns:
+            Restored index
+        """
+        index = cls()
+        for line in data.splitlines():
+            ordinal, _, address = line.partition(' ')
+            index._dates[address] = int(ordinal)
+        return index
+
+
+class CompactIndex(SentIndex):
+    """Memory efficient :class:`SentIndex` for large unfiltered scans.
+
+    Small indexes are kept in a :obj:`dict`, just as :class:`SentIndex` does.
+    Once one holds more than :attr:`COMPACT_SIZE` addresses they are packed
+    back to back as UTF-8 in a single buffer, and dates as 32-bit day
+    ordinals.  Lookups then use an open addressing table of entry numbers, so
+    there are no per-address Python objects to pay for, at the cost of
+    slower updates.
+
+    The address buffer can optionally be moved to a memory-mapped temporary
+    file once it grows past :attr:`SPILL_SIZE` bytes, leaving its paging to
+    the operating system.
+    """
+
+    #: Number of addresses after which the index is packed
+    COMPACT_SIZE = 256 * 1024
+    #: Address buffer size, in bytes, after which it is spilled to disk
+    SPILL_SIZE = 64 * 1024 * 1024
+
+    def __init__(self,
+                 dates: Optional[Mapping[str, datetime.date]] = None,
+                 spill: Optional[Union[pathlib.Path, str]] = None):
+        """Initialise a new `CompactIndex` object.
+
+        Args:
+            dates: Initial address to date data
+            spill: Directory to spill the address buffer to, kept in memory if
+                not specified
+        """
+        self._dates: Optional[Dict[str, int]] = {}
+        self._spill = spill
+        self._file = None
+        self._keys: Union[bytearray, mmap.mmap] = bytearray()
+        self._offsets = array('q', [0])
+        self._hashes = array('I')
+        self._values = array('i')
+        self._slots = array('i', [0]) * 8
+        if dates:
+            for address, date in dates.items():
+                self.update(address, date)
+
+    def __getstate__(self) -> Dict:
+        """Support pickling, for use with :mod:`concurrent.futures`."""
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_keys'] = bytearray(self._keys[:self._offsets[-1]])
+        return state
+
+    def __getitem__(self, address: str) -> datetime.date:
+        """Fetch latest sent date for address."""
+        if self._dates is not None:
+            return super().__getitem__(address)
+        entry = self._find(address.encode())[1]
+        if entry < 0:
+            raise KeyError(address)
+        return datetime.date.fromordinal(self._values[entry])
+
+    def __contains__(self, address: object) -> bool:
+        """Check whether mail has been sent to address."""
+        if self._dates is not None:
+            return super().__contains__(address)
+        if not isinstance(address, str):
+            return False
+        return self._find(address.encode())[1] >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over addresses."""
+        for address, _ in self.ordinals():
+            yield address
+
+    def __len__(self) -> int:
+        """Number of addresses."""
+        if self._dates is not None:
+            return len(self._dates)
+        return len(self._values)
+
+    def _find(self, key: bytes, hashed: Optional[int] = None
+              ) -> Tuple[int, int]:
+        """Locate an address in the lookup table.
+
+        Args:
+            key: UTF-8 encoded address
+            hashed: Precomputed hash of ``key``
+
+        Returns:
+            Table slot, and entry number or ``-1`` if the address is unknown
+        """
+        if hashed is None:
+            hashed = zlib.crc32(key)
+        slots = self._slots
+        hashes = self._hashes
+        offsets = self._offsets
+        mask = len(slots) - 1
+        slot = perturb = hashed
+        while True:
+            slot &= mask
+            entry = slots[slot] - 1
+            if entry < 0:
+                return slot, entry
+            if hashes[entry] == hashed:
+                start = offsets[entry]
+                # Compare in place, rather than copying the stored address
+                if memoryview(self._keys)[start:offsets[entry + 1]] == key:
+                    return slot, entry
+            perturb >>= 5
+            slot = 5 * slot + 1 + perturb
+
+    def _rehash(self, size: int) -> None:
+        """Rebuild the lookup table, and reinsert all entries.
+
+        Args:
+            size: Number of table slots, a power of two
+        """
+        slots = self._slots = array('i', [0]) * size
+        mask = size - 1
+        for entry, hashed in enumerate(self._hashes):
+            slot = perturb = hashed
+            while True:
+                slot &= mask
+                if not slots[slot]:
+                    slots[slot] = entry + 1
+                    break
+                perturb >>= 5
+                slot = 5 * slot + 1 + perturb
+
+    def _pack(self) -> None:
+        """Move addresses from the :obj:`dict` in to the compact tables."""
+        dates, self._dates = self._dates, None
+        for address, ordinal in dates.items():
+            key = address.encode()
+            self._append_key(key)
+            self._hashes.append(zlib.crc32(key))
+            self._values.append(ordinal)
+        size = len(self._slots)
+        while 3 * len(self._values) >= 2 * size:
+            size *= 2
+        self._rehash(size)
+
+    def _append_key(self, key: bytes) -> None:
+        """Add an address to the buffer, spilling to disk if necessary.
+
+        Args:
+            key: UTF-8 encoded address
+        """
+        start = self._offsets[-1]
+        end = start + len(key)
+        if self._file is None:
+            if self._spill and end > self.SPILL_SIZE:
+                os.makedirs(self._spill, exist_ok=True)
+                self._file = tempfile.TemporaryFile(dir=self._spill)
+                self._file.write(self._keys)
+                self._map(2 * end)
+            else:
+                self._keys += key
+        if self._file is not None:
+            if end > len(self._keys):
+                self._map(2 * end)
+            self._keys[start:end] = key
+        self._offsets.append(end)
+
+    def _map(self, size: int) -> None:
+        """Map the spill file in to memory.
+
+        Args:
+            size: Size to extend the file to
+        """
+        if isinstance(self._keys, mmap.mmap):
+            self._keys.close()
+        self._file.truncate(size)
+        self._keys = mmap.mmap(self._file.fileno(), size)
+
+    def update(self, address: str, date: datetime.date) -> None:
+        """Record mail sent to an address.
+
+        Args:
+            address: Recipient address
+            date: Date mail was sent
+        """
+        self._update(address, date.toordinal())
+
+    def _update(self, address: str, ordinal: int) -> None:
+        """Record mail sent to an address.
+
+        Args:
+            address: Recipient address
+            ordinal: Day ordinal mail was sent
+        """
+        dates = self._dates
+        if dates is not None:
+            if ordinal > dates.get(address, 0):
+                dates[address] = ordinal
+                if len(dates) > self.COMPACT_SIZE:
+                    self._pack()
+            return
+        key = address.encode()
+        hashed = zlib.crc32(key)
+        slot, entry = self._find(key, hashed)
+        if entry >= 0:
+            if ordinal > self._values[entry]:
+                self._values[entry] = ordinal
+            return
+        self._append_key(key)
+        self._hashes.append(hashed)
+        self._values.append(ordinal)
+        self._slots[slot] = len(self._values)
+        # Keep the table at most two thirds full, as Python’s dict does
+        if 3 * len(self._values) >= 2 * len(self._slots):
+            self._rehash(2 * len(self._slots))
+
+    def merge(self, other: SentIndex) -> 'CompactIndex':
+        """Combine with another index, keeping the latest dates.
+
+        Args:
+            other: Index to merge in to this one
+
+        Returns:
+            This index, to allow chaining
+        """
+        for address, ordinal in other.ordinals():
+            self._update(address, ordinal)
+        return self
+
+    def subset(self, addresses: Iterable[str]) -> SentIndex:
+        """Extract the data for some addresses.
+
+        Args:
+            addresses: Addresses to include
+
+        Returns:
+            New :class:`SentIndex` containing only the given addresses
+        """
+        index = SentIndex()
+        dates = self._dates
+        if dates is not None:
+            index._dates = {
+                address: dates[address]
+                for address in set(addresses) if address in dates
+            }
+            return index
+        for address in set(addresses):
+            entry = self._find(address.encode())[1]
+            if entry >= 0:
+                index._dates[address] = self._values[entry]
+        return index
+
+    def ordinals(self) -> Iterable[Tuple[str, int]]:
+        """Iterate over addresses and latest sent day ordinals.
+
+        Returns:
+            Address and :meth:`datetime.date.toordinal` pairs
+        """
+        if self._dates is not None:
+            return self._dates.items()
+        return self._packed_ordinals()
+
+    def _packed_ordinals(self) -> Iterator[Tuple[str, int]]:
+        """Iterate over packed addresses and latest sent day ordinals.
+
+        Returns:
+            Address and :meth:`datetime.date.toordinal` pairs
+        """
+        keys = self._keys
+        offsets = self._offsets
+        for entry, ordinal in enumerate(self._values):
+            yield keys[offsets[entry]:offsets[entry + 1]].decode(), ordinal
+
+    @classmethod
+    def loads(cls, data: str) -> 'CompactIndex':
+        """Deserialise index.
+
+        Args:
+            data: Output from :meth:`dumps`
+
+        Returns:
+            Restored index
+        """
+        index = cls()
+        for line in data.splitlines():
+            ordinal, _, address = line.partition(' ')
+            index._update(address, int(ordinal))
+        return index
+
+
+@lru_cache(maxsize=HEADER_CACHE_SIZE)
+def _decode_addresses(values: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Extract normalised addresses from raw recipient header values.
+
+    Args:
+        values: Recipient header values
+
+    Returns:
+        Lower-cased addresses
+    """
+    return tuple(address.lower() for _, address in getaddresses(values))
+
+
+def decode_addresses(values: Iterable) -> Tuple[str, ...]:
+    """Extract normalised addresses from recipient header values.
+
+    Sent mail tends to go to the same people again and again, so results are
+    cached on the raw header values.
+
+    Args:
+        values: Recipient header values
+
+    Returns:
+        Lower-cased addresses
+    """
+    # Non-ASCII headers may be returned as email.header.Header objects, which
+    # aren’t hashable
+    return _decode_addresses(tuple(map(str, values)))
+
+
+@lru_cache(maxsize=HEADER_CACHE_SIZE)
+def _decode_date(value: str) -> Optional[datetime.date]:
+    """Extract the date from a normalised ``Date`` header value.
+
+    Args:
+        value: ``Date`` header value, with the time of day replaced
+
+    Returns:
+        Date mail was sent, or `None` if the header is unusable
+    """
+    parsed = parsedate(value)
+    if not parsed:
+        return None
+    return datetime.date(*parsed[:3])
+
+
+def decode_date(value: Optional[str]) -> Optional[datetime.date]:
+    """Extract the date from a ``Date`` header value.
+
+    Many messages are sent on the same day, so results are cached on the
+    header with its time of day, zone and comment replaced.  The date is taken
+    as written, so those parts never change the result.  Headers that can’t be
+    parsed once normalised are parsed as given, without caching.
+
+    Args:
+        value: ``Date`` header value
+
+    Returns:
+        Date mail was sent, or `None` if the header is missing or unusable
+    """
+    if value is None:
+        return None
+    value = str(value)
+    date = _decode_date(_HEADER_TIME.sub(' 00:00', value, count=1))
+    if date is None:
+        parsed = parsedate(value)
+        if parsed:
+            date = datetime.date(*parsed[:3])
+    return date
+
+
+def header_cache_info() -> Dict[str, Tuple[int, int, Optional[int], int]]:
+    """Report header decoding cache statistics.
+
+    Returns:
+        Keys of ``addresses`` and ``dates``, and values of
+        :func:`functools.lru_cache` statistics with ``hits`` and ``misses``
+        counters
+    """
+    return {
+        'addresses': _decode_addresses.cache_info(),
+        'dates': _decode_date.cache_info(),
+    }
+
+
+def header_cache_clear() -> None:
+    """Empty header decoding caches, and reset their statistics."""
+    _decode_addresses.cache_clear()
+    _decode_date.cache_clear()
+
+
+def record_message(state: Dict, headers: Message) -> None:
+    """Update cached indexes with a message’s recipients.
+
+    Messages without a usable ``Date`` header are skipped.
+
+    Args:
+        state: Cached indexes, with ``to`` and ``all`` recipient keys
+        headers: Message headers
+    """
+    date = decode_date(headers['date'])
+    if not date:
+        return
+    to = headers.get_all('to', [])
+    fields = {
+        'to': to,
+        'all': to + headers.get_all('cc', []) + headers.get_all('bcc', []),
+    }
+    for key, values in fields.items():
+        for address in decode_addresses(values):
+            state[key].update(address, date)
+
+
+def load_state(path: pathlib.Path,
+               keys: Tuple[str, ...] = ('to', 'all')) -> Optional[Dict]:
+    """Read cached indexes for an incremental source.
+
+    Args:
+        path: Location of state file
+        keys: State entries holding indexes
+
+    Returns:
+        State with ``to`` and ``all`` recipient indexes, or `None` if the file
+        is missing or unusable
+    """
+    try:
+        state = json.loads(path.read_text())
+        for key in keys:
+            state[key] = SentIndex.loads(state[key])
+    except (FileNotFoundError, KeyError, TypeError, ValueError):
+        return None
+    return state
+
+
+def save_state(path: pathlib.Path, state: Dict,
+               keys: Tuple[str, ...] = ('to', 'all')) -> None:
+    """Write cached indexes for an incremental source.
+
+    Args:
+        path: Location of state file
+        state: State with ``to`` and ``all`` recipient indexes
+        keys: State entries holding indexes
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f'{path.name}.{os.getpid()}')
+    temp.write_text(
+        json.dumps(dict(state, **{key: state[key].dumps() for key in keys}),
+                   separators=(',', ':')))
+    temp.replace(path)
@@ -0,0 +1,684 @@
+#
+"""_mailbox - mbox, maildir and MH sent mailbox support."""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import itertools
+import mailbox
+import os
+import pathlib
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import (Any, AsyncIterator, Callable, Collection, Dict, Iterable,
+                    Iterator, List, Optional, Set, Tuple, Union)
+
+from jnrbase import xdg_basedir
+
+from ._index import (SentIndex, decode_addresses, decode_date, load_state,
+                     record_message, save_state)
+from ._sources import (Capabilities, Deadline, Position, SentRecord,
+                       SentSource, address_filter, aiter_records, new_index)
+
+#: Default number of messages to read ahead for each read-ahead thread
+READ_AHEAD_DEPTH = 8
+
+
+def _read_headers(path: Union[pathlib.Path, str]) -> bytes:
+    """Read only the header block of a message file.
+
+    Args:
+        path: Location of the message
+
+    Returns:
+        Raw message headers
+    """
+    lines = []
+    with open(path, 'rb') as f:
+        for line in f:
+            if line in (b'\n', b'\r\n'):
+                break
+            lines.append(line)
+    return b''.join(lines)
+
+
+def _try_read_headers(path: Union[pathlib.Path, str]) -> Optional[bytes]:
+    """Read only the header block of a message file, if it still exists.
+
+    Args:
+        path: Location of the message
+
+    Returns:
+        Raw message headers, or `None` if the message has been removed
+    """
+    try:
+        return _read_headers(path)
+    except FileNotFoundError:  # Removed since the folder was listed
+        return None
+
+
+def read_ahead(items: Iterable, read: Callable[[Any], Any], workers: int,
+               depth: Optional[int] = None) -> Iterator:
+    """Apply a blocking read function concurrently, keeping results in order.
+
+    Up to ``depth`` reads are queued on a pool of ``workers`` threads, and
+    results are produced in the order of ``items``.  This hides per-file
+    latency on network filesystems, while parsing stays in the consuming
+    thread.
+
+    Args:
+        items: Arguments for ``read``
+        read: Function to call for each item
+        workers: Number of reader threads
+        depth: Maximum number of reads in flight, :data:`READ_AHEAD_DEPTH`
+            per worker if not specified
+
+    Yields:
+        Result of ``read`` for each item
+    """
+    if not depth:
+        depth = READ_AHEAD_DEPTH * workers
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(workers) as pool:
+        try:
+            for item in itertools.islice(items, depth):
+                pending.append(pool.submit(read, item))
+            while pending:
+                future = pending.popleft()
+                for item in itertools.islice(items, 1):
+                    pending.append(pool.submit(read, item))
+                yield future.result()
+        finally:
+            # Don’t wait on reads nobody will consume
+            for future in pending:
+                future.cancel()
+
+
+def _read_messages(files: List[Tuple[Union[int, str], str]], workers: int = 0,
+                   depth: Optional[int] = None
+                   ) -> Iterator[Tuple[Union[int, str], Message]]:
+    """Read message headers, optionally using a read-ahead pipeline.
+
+    Args:
+        files: Message keys and locations, in the order to process them
+        workers: Number of read-ahead threads, read serially if zero
+        depth: Maximum number of messages to read ahead
+
+    Yields:
+        Message key and headers, skipping messages that have been removed
+    """
+    paths = [path for _, path in files]
+    if workers:
+        contents = read_ahead(paths, _try_read_headers, workers, depth)
+    else:
+        contents = map(_try_read_headers, paths)
+    parser = BytesHeaderParser()
+    for (key, _), data in zip(files, contents):
+        if data is not None:
+            yield key, parser.parsebytes(data)
+
+
+def _message_records(message: Message, all_recipients: bool,
+                     wanted: Optional[Set[str]],
+                     position: Union[int, str]) -> Iterator[SentRecord]:
+    """Generate recipient records from a message.
+
+    Messages without a usable ``Date`` header are skipped, as they are by
+    :func:`record_message` for the incremental indexes.
+
+    Args:
+        message: Message, or just its headers
+        all_recipients: Whether to include CC and BCC addresses
+        wanted: Addresses to look for, all if `None`
+        position: Location of the message in its mailbox
+
+    Yields:
+        Recipient records
+    """
+    fields = message.get_all('to', [])
+    if all_recipients:
+        fields.extend(message.get_all('cc', []))
+        fields.extend(message.get_all('bcc', []))
+    date = decode_date(message['date'])
+    if date is None:
+        return
+    for address in decode_addresses(fields):
+        if not wanted or address in wanted:
+            yield SentRecord(address, date, position)
+
+
+def _mh_numbers(path: pathlib.Path, newest_first: bool = True) -> List[int]:
+    """List message numbers in a MH folder.
+
+    Args:
+        path: Location of the MH folder
+        newest_first: Whether to sort highest numbers first
+
+    Returns:
+        Message numbers
+    """
+    return sorted((int(entry.name) for entry in os.scandir(path)
+                   if entry.name.isdigit() and entry.is_file()),
+                  reverse=newest_first)
+
+
+def _mh_stamps(path: pathlib.Path) -> Dict[int, List[int]]:
+    """Fetch modification times and sizes for messages in a MH folder.
+
+    Args:
+        path: Location of the MH folder
+
+    Returns:
+        Keys of message number, and values of modification time in
+        nanoseconds and size
+    """
+    stamps = {}
+    for entry in os.scandir(path):
+        if entry.name.isdigit() and entry.is_file():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # Removed since listing
+                continue
+            stamps[int(entry.name)] = [stat.st_mtime_ns, stat.st_size]
+    return stamps
+
+
+def mh_sequences(path: pathlib.Path) -> Dict[str, Set[int]]:
+    """Read sequences from a MH folder.
+
+    Unlike :meth:`mailbox.MH.get_sequences` this doesn’t list the folder to
+    drop missing messages.
+
+    Args:
+        path: Location of the MH folder
+
+    Returns:
+        Keys of sequence name, and values of message numbers
+    """
+    sequences = {}
+    try:
+        f = path.joinpath('.mh_sequences').open()
+    except FileNotFoundError:
+        return sequences
+    with f:
+        for line in f:
+            name, sep, contents = line.partition(':')
+            if not sep:
+                continue
+            numbers = set()
+            for spec in contents.split():
+                first, _, last = spec.partition('-')
+                numbers.update(range(int(first), int(last or first) + 1))
+            sequences[name.strip()] = numbers
+    return sequences
+
+
+def iter_mh(path: pathlib.Path,
+            all_recipients: bool = False,
+            addresses: List[str] = None,
+            skip: Collection[int] = frozenset(),
+            newest_first: bool = True,
+            workers: int = 0,
+            depth: Optional[int] = None) -> Iterator[SentRecord]:
+    """Iterate over recipients in a MH folder.
+
+    The folder is listed once, and only the headers of each message are read.
+    Processing the highest numbered messages first means the newest mail is
+    seen first, so consumers can stop early.
+
+    Args:
+        path: Location of the MH folder
+        all_recipients: Whether to include CC and BCC addresses in
+            results, or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        skip: Message numbers to ignore
+        newest_first: Whether to process highest numbered messages first
+        workers: Number of read-ahead threads, read serially if zero
+        depth: Maximum number of messages to read ahead
+
+    Returns:
+        Recipient records
+    """
+    if not path.is_dir():
+        raise IOError(f'Sent mailbox ‘{path}’ not found')
+    files = [(n, os.path.join(path, str(n)))
+             for n in _mh_numbers(path, newest_first) if n not in skip]
+    return _iter_files(files, all_recipients, address_filter(addresses),
+                       workers, depth)
+
+
+def _iter_files(files: List[Tuple[Union[int, str], str]],
+                all_recipients: bool, wanted: Optional[Set[str]],
+                workers: int, depth: Optional[int],
+                deadline: Optional[Deadline] = None) -> Iterator[SentRecord]:
+    """Generate recipient records from message files.
+
+    Args:
+        files: Message keys and locations, in the order to process them
+        all_recipients: Whether to include CC and BCC addresses
+        wanted: Addresses to look for, all if `None`
+        workers: Number of read-ahead threads, read serially if zero
+        depth: Maximum number of messages to read ahead
+        deadline: Stop reading messages when this expires
+
+    Yields:
+        Recipient records
+    """
+    for key, headers in _read_messages(files, workers, depth):
+        if deadline and deadline.check():
+            return
+        yield from _message_records(headers, all_recipients, wanted, key)
+        if deadline:
+            deadline.mark(key)
+
+
+def _maildir_files(path: pathlib.Path,
+                   colon: str = mailbox.Maildir.colon
+                   ) -> List[Tuple[str, str]]:
+    """List message files in a maildir.
+
+    Args:
+        path: Location of the maildir
+        colon: Separator between unique name and message flags
+
+    Returns:
+        Message keys and locations, sorted by key
+    """
+    files = []
+    for sub in ('new', 'cur'):
+        for entry in os.scandir(os.path.join(path, sub)):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            files.append((entry.name.split(colon)[0], entry.path))
+    return sorted(files)
+
+
+def _mh_state_path(path: pathlib.Path) -> pathlib.Path:
+    """Location of the cached indexes for a MH folder.
+
+    Args:
+        path: Location of the MH folder
+
+    Returns:
+        State file path
+    """
+    key = path.resolve().as_posix()
+    return pathlib.Path(xdg_basedir.user_cache('blanco')) / 'mh' \
+        / hashlib.sha1(key.encode()).hexdigest()
+
+
+def sync_mh(path: pathlib.Path, sequence: str, workers: int = 0,
+            depth: Optional[int] = None) -> Dict:
+    """Synchronise cached indexes for a MH folder.
+
+    Messages that have been recorded are added to ``sequence`` in the folder’s
+    :file:`.mh_sequences`, so they are skipped on later runs.  Using a
+    sequence, rather than the highest message number seen, means the
+    checkpoint survives :command:`folder -pack` and friends.
+
+    Numbers are reused when a tool that doesn’t maintain ``sequence`` removes
+    messages, so each message’s modification time and size are cached too,
+    and any message whose file has changed is read again.
+
+    Args:
+        path: Location of the MH folder
+        sequence: Name of sequence to track recorded messages with
+        workers: Number of read-ahead threads, read serially if zero
+        depth: Maximum number of messages to read ahead
+
+    Returns:
+        State with ``to`` and ``all`` recipient indexes
+    """
+    state_file = _mh_state_path(path)
+    state = load_state(state_file)
+    sequences = mh_sequences(path)
+    if state is None:
+        state = {'to': SentIndex(), 'all': SentIndex()}
+        handled = set()
+    else:
+        handled = sequences.get(sequence, set())
+
+    seen = state.get('stamps', {})
+    stamps = _mh_stamps(path)
+    numbers = sorted(stamps, reverse=True)
+    files = [(n, os.path.join(path, str(n))) for n in numbers
+             if n not in handled or seen.get(str(n)) != stamps[n]]
+    for _, headers in _read_messages(files, workers, depth):
+        record_message(state, headers)
+
+    if files or handled != set(numbers) or len(seen) != len(stamps):
+        # State goes first, re-reading a message is harmless but skipping an
+        # unrecorded one is not
+        state['stamps'] = {str(n): stamp for n, stamp in stamps.items()}
+        save_state(state_file, state)
+        sequences[sequence] = numbers
+        try:
+            mailbox.MH(path.as_posix(), create=False).set_sequences(sequences)
+        except OSError:  # Read-only folder, messages are re-read next time
+            pass
+    return state
+
+
+def _open_mailbox(path: pathlib.Path) -> mailbox.Mailbox:
+    """Open sent mailbox, detecting its format.
+
+    Args:
+        path: Location of the sent mailbox
+
+    Returns:
+        Mailbox object
+    """
+    if not path.exists():
+        raise IOError(f'Sent mailbox ‘{path}’ not found')
+    if path.is_file():
+        mtype = mailbox.mbox
+    elif path.is_dir() and path.joinpath('new').exists():
+        mtype = mailbox.Maildir
+    elif path.is_dir() and path.joinpath('.mh_sequences').exists():
+        mtype = mailbox.MH
+    else:
+        raise ValueError(f'Unknown mailbox format for ‘{path}’')
+    # Use factory=None to work around the rfc822.Message default for Maildir.
+    return mtype(path.as_posix(), factory=None, create=False)
+
+
+def iter_sent(path: pathlib.Path,
+              all_recipients: bool = False,
+              addresses: List[str] = None,
+              workers: int = 0,
+              depth: Optional[int] = None) -> Iterator[SentRecord]:
+    """Iterate over recipients in a sent messages mailbox.
+
+    Messages are read lazily in file order; for maildir that is delivery
+    order, as unique names start with a timestamp.
+
+    Maildir and MH messages can be read with a read-ahead pipeline, see
+    :func:`read_ahead`, which produces identical results.
+
+    Args:
+        path: Location of the sent mailbox
+        all_recipients: Whether to include CC and BCC addresses in
+            results, or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        workers: Number of read-ahead threads, read serially if zero
+        depth: Maximum number of messages to read ahead
+
+    Returns:
+        Recipient records
+    """
+    mbox = _open_mailbox(path)
+    if isinstance(mbox, mailbox.MH):
+        return iter_mh(path, all_recipients, addresses, newest_first=False,
+                       workers=workers, depth=depth)
+    wanted = address_filter(addresses)
+    if workers and isinstance(mbox, mailbox.Maildir):
+        return _iter_files(_maildir_files(path, mbox.colon), all_recipients,
+                           wanted, workers, depth)
+    return _iter_mailbox(mbox, all_recipients, wanted)
+
+
+def _iter_mailbox(mbox: mailbox.Mailbox, all_recipients: bool,
+                  wanted: Optional[Set[str]],
+                  keys: Optional[List[Union[int, str]]] = None,
+                  deadline: Optional[Deadline] = None
+                  ) -> Iterator[SentRecord]:
+    """Generate recipient records from a mailbox.
+
+    Args:
+        mbox: Sent mailbox
+        all_recipients: Whether to include CC and BCC addresses
+        wanted: Addresses to look for, all if `None`
+        keys: Message keys in the order to process them, all messages in
+            file order if not specified
+        deadline: Stop reading messages when this expires
+
+    Yields:
+        Recipient records
+    """
+    if keys is None:
+        keys = sorted(mbox.iterkeys())
+    for key in keys:
+        if deadline and deadline.check():
+            return
+        yield from _message_records(mbox[key], all_recipients, wanted, key)
+        if deadline:
+            deadline.mark(key)
+
+
+def _between(items: List[Tuple[Union[int, str], Any]],
+             after: Optional[Position],
+             before: Optional[Position]
+             ) -> List[Tuple[Union[int, str], Any]]:
+    """Select messages in a range of positions.
+
+    Args:
+        items: Message keys, with associated data
+        after: Only select messages after this position
+        before: Only select messages before this position
+
+    Returns:
+        Selected messages
+    """
+    return [item for item in items
+            if (after is None or item[0] > after.position)
+            and (before is None or item[0] < before.position)]
+
+
+def iter_sent_newest(path: pathlib.Path,
+                     all_recipients: bool = False,
+                     addresses: List[str] = None,
+                     after: Optional[Position] = None,
+                     before: Optional[Position] = None,
+                     deadline: Optional[Deadline] = None,
+                     workers: int = 0,
+                     depth: Optional[int] = None) -> Iterator[SentRecord]:
+    """Iterate over recipients in a sent messages mailbox, newest first.
+
+    Messages are read in reverse file order, so a scan that stops early has
+    seen the most recent mail.  Positions are message keys, which is enough
+    to resume a scan as long as the mailbox is only appended to.  Messages
+    that are read in full are recorded with :meth:`Deadline.mark`.
+
+    mbox files must still be read in full to build their table of contents,
+    but only the headers of messages that are processed are parsed.
+
+    Args:
+        path: Location of the sent mailbox
+        all_recipients: Whether to include CC and BCC addresses in
+            results, or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        after: Only read messages newer than this position
+        before: Only read messages older than this position
+        deadline: Stop reading messages when this expires
+        workers: Number of read-ahead threads, read serially if zero
+        depth: Maximum number of messages to read ahead
+
+    Returns:
+        Recipient records
+    """
+    mbox = _open_mailbox(path)
+    wanted = address_filter(addresses)
+    if isinstance(mbox, mailbox.MH):
+        files = [(n, os.path.join(path, str(n))) for n in _mh_numbers(path)]
+    elif isinstance(mbox, mailbox.Maildir):
+        files = _maildir_files(path, mbox.colon)[::-1]
+    else:
+        keys = sorted(mbox.iterkeys(), reverse=True)
+        keys = [key for key, _ in _between(zip(keys, keys), after, before)]
+        return _iter_mailbox(mbox, all_recipients, wanted, keys, deadline)
+    return _iter_files(_between(files, after, before), all_recipients, wanted,
+                       workers, depth, deadline)
+
+
+def parse_sent(path: pathlib.Path,
+               all_recipients: bool = False,
+               addresses: List[str] = None,
+               index: Optional[SentIndex] = None,
+               sequence: Optional[str] = None,
+               workers: int = 0,
+               depth: Optional[int] = None,
+               deadline: Optional[Deadline] = None) -> SentIndex:
+    """Parse sent messages mailbox for contact details.
+
+    With a deadline the mailbox is read newest first, see
+    :func:`iter_sent_newest`, and reading stops when the deadline expires.
+
+    Args:
+        path: Location of the sent mailbox
+        all_recipients: Whether to include CC and BCC addresses in
+            results, or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        index: Index to add results to, a new index if not specified
+        sequence: MH sequence for tracking messages already recorded, see
+            :func:`sync_mh`
+        workers: Number of read-ahead threads, read serially if zero
+        depth: Maximum number of messages to read ahead
+        deadline: Time budget for reading, check its ``expired`` attribute
+            to find out whether the results are complete
+
+    Returns:
+        Keys of email address, and values of seen date
+    """
+    if index is None:
+        index = new_index(all_recipients, addresses)
+    if sequence and isinstance(_open_mailbox(path), mailbox.MH):
+        state = sync_mh(path, sequence, workers, depth)
+        seen = state['all' if all_recipients else 'to']
+        wanted = address_filter(addresses)
+        return index.merge(seen.subset(wanted) if wanted else seen)
+    if deadline:
+        records = iter_sent_newest(path, all_recipients, addresses,
+                                   deadline=deadline, workers=workers,
+                                   depth=depth)
+    else:
+        records = iter_sent(path, all_recipients, addresses, workers, depth)
+    for address, date, _ in records:
+        index.update(address, date)
+    return index
+
+
+def aiter_sent(path: pathlib.Path,
+               all_recipients: bool = False,
+               addresses: List[str] = None,
+               chunk_size: int = 256) -> AsyncIterator[SentRecord]:
+    """Asynchronously iterate over recipients in a sent messages mailbox.
+
+    See :func:`iter_sent`.
+
+    Args:
+        path: Location of the sent mailbox
+        all_recipients: Whether to include CC and BCC addresses in
+            results, or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        chunk_size: Number of records to read in each step
+
+    Returns:
+        Recipient records
+    """
+    return aiter_records(iter_sent(path, all_recipients, addresses),
+                         chunk_size)
+
+
+class MailboxSource(SentSource):
+    """Sent mail stored in a mbox, maildir or MH mailbox.
+
+    The ``mh sequence``, ``read ahead`` and ``read ahead depth`` options are
+    supported, see :func:`parse_sent`.
+    """
+
+    location_key = 'mbox'
+    capabilities = Capabilities(ordering='oldest', incremental=True,
+                                parallel=True, bounded=True)
+    result_options = ('mh sequence', )
+
+    def _read_ahead(self) -> Tuple[int, Optional[int]]:
+        """Read-ahead settings.
+
+        Returns:
+            Number of read-ahead threads, and maximum messages to read ahead
+        """
+        return (self.options.get('read ahead') or 0,
+                self.options.get('read ahead depth') or None)
+
+    def records(self,
+                all_recipients: bool = False,
+                addresses: List[str] = None) -> Iterator[SentRecord]:
+        """Iterate over recipients in the mailbox.
+
+        See :func:`iter_sent`.
+        """
+        return iter_sent(self.location, all_recipients, addresses,
+                         *self._read_ahead())
+
+    def fingerprint(self, position: Union[int, str]) -> Optional[str]:
+        """Identify the message with a key.
+
+        Only the headers are read, which is enough to tell messages apart.
+
+        Args:
+            position: Message key
+
+        Returns:
+            Digest of the message’s headers, or `None` if there is no message
+            with that key
+        """
+        try:
+            f = _open_mailbox(self.location).get_file(position)
+        except KeyError:
+            return None
+        digest = hashlib.sha1()
+        with f:
+            for line in f:
+                if not line.strip():
+                    break
+                digest.update(line)
+        return digest.hexdigest()
+
+    def newest_records(self,
+                       all_recipients: bool = False,
+                       addresses: List[str] = None,
+                       after: Optional[Position] = None,
+                       before: Optional[Position] = None,
+                       deadline: Optional[Deadline] = None
+                       ) -> Iterator[SentRecord]:
+        """Iterate over recipients in the mailbox, newest first.
+
+        See :func:`iter_sent_newest`.
+        """
+        workers, depth = self._read_ahead()
+        return iter_sent_newest(self.location, all_recipients, addresses,
+                                after, before, deadline, workers, depth)
+
+    def read(self,
+             all_recipients: bool = False,
+             addresses: List[str] = None) -> SentIndex:
+        """Read the mailbox in to an index.
+
+        See :func:`parse_sent`.
+        """
+        workers, depth = self._read_ahead()
+        return parse_sent(self.location, all_recipients, addresses,
+                          sequence=self.options.get('mh sequence') or None,
+                          workers=workers, depth=depth)
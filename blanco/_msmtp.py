@@ -0,0 +1,429 @@
+#
+"""_msmtp - msmtp logfile support."""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import datetime
+import hashlib
+import os
+import pathlib
+import time
+
+from functools import lru_cache
+from typing import (AsyncIterator, BinaryIO, Iterator, List, Optional, Set,
+                    Tuple, Union)
+
+import parse
+
+from ._index import SentIndex
+from ._sources import (Capabilities, Deadline, Position, SentRecord,
+                       SentSource, address_filter, aiter_records, new_index)
+
+#: Size of blocks to read when stepping backwards through a log
+BLOCK_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def _log_month_day(prefix: str) -> Tuple[int, int]:
+    """Parse date prefix from a msmtp log entry.
+
+    Args:
+        prefix: Start of log line, for example ``Feb 09``
+
+    Returns:
+        Month and day
+    """
+    return time.strptime(prefix, '%b %d')[1:3]
+
+
+def _log_year_wraps(log: pathlib.Path, end: Tuple[int, int]) -> int:
+    """Count year changes in a msmtp log.
+
+    Log entries don’t include the year, so when reading forwards we need to
+    know how many times the year changes before the log’s modification time.
+
+    Args:
+        log: Location of the msmtp logfile
+        end: Month and day of log’s modification time
+
+    Returns:
+        Number of year changes
+    """
+    wraps = 0
+    prev = None
+    with log.open() as f:
+        for line in f:
+            if line.endswith('exitcode=EX_OK\n'):
+                md = _log_month_day(line[:6])
+                if prev and prev > md:
+                    wraps += 1
+                prev = md
+    if prev and prev > end:
+        wraps += 1
+    return wraps
+
+
+def iter_msmtp(log: pathlib.Path,
+               all_recipients: bool = False,
+               addresses: List[str] = None,
+               gmail: bool = False) -> Iterator[SentRecord]:
+    """Iterate over recipients in a msmtp logfile.
+
+    Entries are read lazily in file order.  Non-gmail logs don’t record the
+    year, so they are pre-scanned for year changes to date entries relative
+    to the log’s modification time.
+
+    Args:
+        log: Location of the msmtp logfile
+        all_recipients: Whether to include all recipients in results,
+            or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        gmail: Log is for a gmail account
+
+    Returns:
+        Recipient records
+    """
+    if not log.exists():
+        raise IOError(f'msmtp sent log ‘{log}’ not found')
+    return _iter_msmtp(log, all_recipients, address_filter(addresses), gmail)
+
+
+def _iter_msmtp(log: pathlib.Path, all_recipients: bool,
+                wanted: Optional[Set[str]],
+                gmail: bool) -> Iterator[SentRecord]:
+    """Generate recipient records from a msmtp logfile.
+
+    Args:
+        log: Location of the msmtp logfile
+        all_recipients: Whether to include all recipients
+        wanted: Addresses to look for, all if `None`
+        gmail: Log is for a gmail account
+
+    Yields:
+        Recipient records
+    """
+    matcher = parse.compile(' recipients={recip:S} ')
+    gmail_date = parse.compile(' OK {timestamp:d} ')
+
+    if not gmail:
+        end = datetime.datetime.utcfromtimestamp(log.stat().st_mtime)
+        year = end.year - _log_year_wraps(log, (end.month, end.day))
+        prev = None
+    with log.open() as f:
+        for number, line in enumerate(f, 1):
+            if not line.endswith('exitcode=EX_OK\n'):
+                continue
+            if gmail:
+                gd = gmail_date.search(line)
+                if not gd:
+                    raise ValueError(
+                        f'msmtp {log!r} log is not in gmail format')
+                date = datetime.datetime.utcfromtimestamp(
+                    gd['timestamp']).date()
+            else:
+                md = _log_month_day(line[:6])
+                if prev and prev > md:
+                    year += 1
+                prev = md
+                date = datetime.date(year, *md)
+
+            results = matcher.search(line)['recip'].split(',')
+            if not all_recipients:
+                results = results[:1]
+            for address in results:
+                address = address.lower()
+                if not wanted or address in wanted:
+                    yield SentRecord(address, date, number)
+
+
+def _reverse_lines(f: BinaryIO, start: int,
+                   end: int) -> Iterator[Tuple[int, bytes]]:
+    """Step backwards through lines in a file.
+
+    Args:
+        f: File to read
+        start: Offset of first line to produce
+        end: Offset to stop reading at, which must be the end of a line
+
+    Yields:
+        Offset of line, and its contents without the line ending
+    """
+    tail = b''
+    pos = end
+    while pos > start:
+        size = min(BLOCK_SIZE, pos - start)
+        pos -= size
+        f.seek(pos)
+        head, *lines = (f.read(size) + tail).split(b'\n')
+        offset = pos + len(head) + sum(len(line) + 1 for line in lines)
+        for line in reversed(lines):
+            offset -= len(line)
+            yield offset, line
+            offset -= 1
+        tail = head
+    if tail:
+        yield start, tail
+
+
+def _line_end(f: BinaryIO, offset: int) -> int:
+    """Find the end of a line in a file.
+
+    Args:
+        f: File to read
+        offset: Start of line
+
+    Returns:
+        Offset of the next line
+    """
+    f.seek(offset)
+    f.readline()
+    return f.tell()
+
+
+def iter_msmtp_newest(log: pathlib.Path,
+                      all_recipients: bool = False,
+                      addresses: List[str] = None,
+                      gmail: bool = False,
+                      after: Optional[Position] = None,
+                      before: Optional[Position] = None,
+                      deadline: Optional[Deadline] = None
+                      ) -> Iterator[SentRecord]:
+    """Iterate over recipients in a msmtp logfile, newest first.
+
+    The log is read backwards in blocks of :data:`BLOCK_SIZE`, so a scan that
+    stops early only touches the end of the log.  Positions are byte offsets
+    of log lines, and entries that are read in full are recorded with
+    :meth:`Deadline.mark` along with their date.  Working backwards also
+    means non-gmail logs don’t need a pre-scan for year changes, the year is
+    counted down from the log’s modification time instead.
+
+    Args:
+        log: Location of the msmtp logfile
+        all_recipients: Whether to include all recipients in results,
+            or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        gmail: Log is for a gmail account
+        after: Only read entries newer than this position
+        before: Only read entries older than this position
+        deadline: Stop reading entries when this expires
+
+    Returns:
+        Recipient records
+    """
+    if not log.exists():
+        raise IOError(f'msmtp sent log ‘{log}’ not found')
+    return _iter_msmtp_newest(log, all_recipients, address_filter(addresses),
+                              gmail, after, before, deadline)
+
+
+def _iter_msmtp_newest(log: pathlib.Path, all_recipients: bool,
+                       wanted: Optional[Set[str]], gmail: bool,
+                       after: Optional[Position],
+                       before: Optional[Position],
+                       deadline: Optional[Deadline]) -> Iterator[SentRecord]:
+    """Generate recipient records from a msmtp logfile, newest first.
+
+    Args:
+        log: Location of the msmtp logfile
+        all_recipients: Whether to include all recipients
+        wanted: Addresses to look for, all if `None`
+        gmail: Log is for a gmail account
+        after: Only read entries newer than this position
+        before: Only read entries older than this position
+        deadline: Stop reading entries when this expires
+
+    Yields:
+        Recipient records
+    """
+    matcher = parse.compile(' recipients={recip:S} ')
+    gmail_date = parse.compile(' OK {timestamp:d} ')
+
+    with log.open('rb') as f:
+        stat = os.fstat(f.fileno())
+        end = stat.st_size
+        if before:
+            # Resuming, so the year is known from the entry we stopped at
+            end = min(end, before.position)
+            year = before.date.year
+            prev = (before.date.month, before.date.day)
+        else:
+            mtime = datetime.datetime.utcfromtimestamp(stat.st_mtime)
+            year = mtime.year
+            prev = (mtime.month, mtime.day)
+        # A position past the end belongs to a log that has since been
+        # truncated, so nothing after it can be trusted
+        if after and after.position < stat.st_size:
+            start = _line_end(f, after.position)
+        else:
+            start = 0
+
+        for offset, raw in _reverse_lines(f, start, end):
+            if not raw.endswith(b'exitcode=EX_OK'):
+                continue
+            if deadline and deadline.check():
+                return
+            line = raw.decode(errors='replace')
+            if gmail:
+                gd = gmail_date.search(line)
+                if not gd:
+                    raise ValueError(
+                        f'msmtp {log!r} log is not in gmail format')
+                date = datetime.datetime.utcfromtimestamp(
+                    gd['timestamp']).date()
+            else:
+                md = _log_month_day(line[:6])
+                if md > prev:
+                    year -= 1
+                prev = md
+                date = datetime.date(year, *md)
+
+            results = matcher.search(line)['recip'].split(',')
+            if not all_recipients:
+                results = results[:1]
+            for address in results:
+                address = address.lower()
+                if not wanted or address in wanted:
+                    yield SentRecord(address, date, offset)
+            if deadline:
+                deadline.mark(offset, date)
+
+
+def parse_msmtp(log: pathlib.Path,
+                all_recipients: bool = False,
+                addresses: List[str] = None,
+                gmail: bool = False,
+                index: Optional[SentIndex] = None,
+                deadline: Optional[Deadline] = None) -> SentIndex:
+    """Parse sent messages mailbox for contact details.
+
+    With a deadline the log is read newest first, see
+    :func:`iter_msmtp_newest`, and reading stops when the deadline expires.
+
+    Args:
+        log: Location of the msmtp logfile
+        all_recipients: Whether to include all recipients in results,
+            or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        gmail: Log is for a gmail account
+        index: Index to add results to, a new index if not specified
+        deadline: Time budget for reading, check its ``expired`` attribute
+            to find out whether the results are complete
+
+    Returns:
+        Keys of email address, and values of seen date
+    """
+    if index is None:
+        index = new_index(all_recipients, addresses)
+    if deadline:
+        records = iter_msmtp_newest(log, all_recipients, addresses, gmail,
+                                    deadline=deadline)
+    else:
+        records = iter_msmtp(log, all_recipients, addresses, gmail)
+    for address, date, _ in records:
+        index.update(address, date)
+    return index
+
+
+def aiter_msmtp(log: pathlib.Path,
+                all_recipients: bool = False,
+                addresses: List[str] = None,
+                gmail: bool = False,
+                chunk_size: int = 256) -> AsyncIterator[SentRecord]:
+    """Asynchronously iterate over recipients in a msmtp logfile.
+
+    See :func:`iter_msmtp`.
+
+    Args:
+        log: Location of the msmtp logfile
+        all_recipients: Whether to include all recipients in results,
+            or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        gmail: Log is for a gmail account
+        chunk_size: Number of records to read in each step
+
+    Returns:
+        Recipient records
+    """
+    return aiter_records(
+        iter_msmtp(log, all_recipients, addresses, gmail), chunk_size)
+
+
+class MsmtpSource(SentSource):
+    """Sent mail recorded in a msmtp logfile.
+
+    The ``gmail`` option is supported, see :func:`parse_msmtp`.
+    """
+
+    location_key = 'log'
+    capabilities = Capabilities(ordering='oldest', bounded=True)
+    result_options = ('gmail', )
+
+    def records(self,
+                all_recipients: bool = False,
+                addresses: List[str] = None) -> Iterator[SentRecord]:
+        """Iterate over recipients in the logfile.
+
+        See :func:`iter_msmtp`.
+        """
+        return iter_msmtp(self.location, all_recipients, addresses,
+                          bool(self.options.get('gmail')))
+
+    def fingerprint(self, position: Union[int, str]) -> Optional[str]:
+        """Identify the log entry at a byte offset.
+
+        Args:
+            position: Offset of the log line
+
+        Returns:
+            Digest of the line, or `None` if the log is shorter
+        """
+        try:
+            with self.location.open('rb') as f:
+                f.seek(position)
+                line = f.readline()
+        except FileNotFoundError:
+            return None
+        return hashlib.sha1(line).hexdigest() if line else None
+
+    def newest_records(self,
+                       all_recipients: bool = False,
+                       addresses: List[str] = None,
+                       after: Optional[Position] = None,
+                       before: Optional[Position] = None,
+                       deadline: Optional[Deadline] = None
+                       ) -> Iterator[SentRecord]:
+        """Iterate over recipients in the logfile, newest first.
+
+        See :func:`iter_msmtp_newest`.
+        """
+        return iter_msmtp_newest(self.location, all_recipients, addresses,
+                                 bool(self.options.get('gmail')), after,
+                                 before,
+                                 deadline)
+
+    def read(self,
+             all_recipients: bool = False,
+             addresses: List[str] = None) -> SentIndex:
+        """Read the logfile in to an index.
+
+        See :func:`parse_msmtp`.
+        """
+        return parse_msmtp(self.location, all_recipients, addresses,
+                           bool(self.options.get('gmail')))
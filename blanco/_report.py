@@ -0,0 +1,122 @@
+#
+"""_report - Machine-readable contact reports."""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import csv
+import datetime
+import io
+import json
+
+from typing import (BinaryIO, Dict, Iterable, List, NamedTuple, Optional,
+                    Tuple)
+
+#: Supported report formats
+FORMATS = ('csv', 'json', 'ndjson')
+
+#: Size of text buffer between records and the output stream
+BUFFER_SIZE = 64 * 1024
+
+
+class ContactReport(NamedTuple):
+    """Result of checking a contact."""
+
+    #: Contact’s name
+    name: str
+    #: Contact’s addresses
+    addresses: Tuple[str, ...]
+    #: Mail the trigger date is based on, the earliest of each address’s most
+    #: recent mail
+    last_sent: Optional[datetime.date]
+    #: Date reminders start on
+    trigger: Optional[datetime.date]
+    #: Days since the trigger date, negative if it is still to come
+    days_overdue: Optional[int]
+    #: ``due``, ``pending``, ``missing`` or ``unknown``
+    status: str
+
+
+def _isoformat(date: Optional[datetime.date]) -> Optional[str]:
+    """Format optional date.
+
+    Args:
+        date: Date to format
+
+    Returns:
+        ISO-8601 date, or `None`
+    """
+    return date.isoformat() if date else None
+
+
+def write(reports: Iterable[ContactReport], fmt: str,
+          stream: BinaryIO) -> Dict[str, List[Optional[datetime.date]]]:
+    """Write contact reports.
+
+    Reports are encoded as they arrive, and written through a single text
+    buffer of :data:`BUFFER_SIZE`, so large addressbooks don’t pay for a write
+    per contact.  ``json`` produces a single array, ``ndjson`` a document per
+    line, and ``csv`` a header row followed by a row per contact with
+    addresses separated by spaces.
+
+    Args:
+        reports: Contact reports
+        fmt: Output format, one of :data:`FORMATS`
+        stream: Binary stream to write to, left open
+
+    Returns:
+        Keys of status, and values of trigger dates
+
+    Raises:
+        ValueError: Unknown output format
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown report format ‘{fmt}’')
+    out = io.TextIOWrapper(io.BufferedWriter(stream, BUFFER_SIZE),
+                           encoding='utf-8', newline='')
+    summary = {}
+    if fmt == 'csv':
+        writer = csv.writer(out, lineterminator='\n')
+        writer.writerow(ContactReport._fields)
+    else:
+        encode = json.JSONEncoder(ensure_ascii=False).encode
+        separator = '[\n' if fmt == 'json' else ''
+    for report in reports:
+        summary.setdefault(report.status, []).append(report.trigger)
+        last_sent = _isoformat(report.last_sent)
+        trigger = _isoformat(report.trigger)
+        if fmt == 'csv':
+            writer.writerow((report.name, ' '.join(report.addresses),
+                             last_sent, trigger, report.days_overdue,
+                             report.status))
+        else:
+            out.write(separator)
+            out.write(encode({
+                'name': report.name,
+                'addresses': report.addresses,
+                'last_sent': last_sent,
+                'trigger': trigger,
+                'days_overdue': report.days_overdue,
+                'status': report.status,
+            }))
+            separator = ',\n' if fmt == 'json' else '\n'
+    if fmt == 'json':
+        out.write('\n]\n' if summary else '[]\n')
+    elif fmt == 'ndjson' and summary:
+        out.write('\n')
+    out.flush()
+    # Leave the caller’s stream open
+    out.detach().detach()
+    return summary
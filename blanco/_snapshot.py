@@ -0,0 +1,176 @@
+#
+"""_snapshot - Precomputed status for fast overdue checks."""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# This module backs the ``--status`` fast path, which is expected to run from
+# shell prompts.  Keep the imports to cheap standard library modules; typing
+# and datetime are avoided on purpose, ISO-8601 date strings compare correctly
+# without them.  The same goes for the file format, json would pull in re.
+
+import errno
+import os
+import sys
+import time
+
+#: Snapshot format version, bump on incompatible changes
+VERSION = 1
+
+
+def snapshot_path() -> str:
+    """Location of the status snapshot.
+
+    Returns:
+        Snapshot file path, honouring :envvar:`XDG_CACHE_HOME`
+    """
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache, 'blanco', 'status')
+
+
+def source_mtimes(paths: list) -> dict:
+    """Fetch modification times for sources used in a run.
+
+    Maildir’s ``new`` and ``cur`` directories are included, as delivering or
+    filing a message doesn’t touch the top-level directory.
+
+    Args:
+        paths: Addressbook and sent mail locations
+
+    Returns:
+        Keys of location, and values of modification time
+    """
+    mtimes = {}
+    for path in map(os.path.abspath, paths):
+        candidates = [path]
+        if os.path.isdir(path):
+            candidates.extend(os.path.join(path, sub) for sub in ('new', 'cur')
+                              if os.path.isdir(os.path.join(path, sub)))
+        for candidate in candidates:
+            try:
+                mtimes[candidate] = os.stat(candidate).st_mtime
+            except FileNotFoundError:
+                mtimes[candidate] = None
+    return mtimes
+
+
+def write(path: str, due: int, missing: int, pending: list,
+          sources: list) -> None:
+    """Write status snapshot.
+
+    Args:
+        path: Location of snapshot file
+        due: Number of contacts with mail due
+        missing: Number of contacts with no mail record
+        pending: Trigger dates for contacts not yet due
+        sources: Addressbook and sent mail locations
+    """
+    lines = [
+        f'blanco-status {VERSION}',
+        f'due {due}',
+        f'missing {missing}',
+        ' '.join(['pending'] + sorted(date.isoformat() for date in pending)),
+    ]
+    for source, mtime in source_mtimes(sources).items():
+        lines.append(f'source {mtime!r} {source}')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Replace atomically, so a prompt never sees a partially written file
+    temp = f'{path}.{os.getpid()}'
+    with open(temp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temp, path)
+
+
+def read(path: str) -> dict:
+    """Read status snapshot.
+
+    Args:
+        path: Location of snapshot file
+
+    Returns:
+        Keys of ``due``, ``missing``, ``pending`` trigger dates and ``sources``
+        modification times
+
+    Raises:
+        ValueError: Unsupported snapshot version
+    """
+    with open(path) as f:
+        header, *lines = f.read().splitlines()
+    if header != f'blanco-status {VERSION}':
+        raise ValueError(f'Unsupported status snapshot version in ‘{path}’')
+    data = {'sources': {}}
+    for line in lines:
+        key, _, value = line.partition(' ')
+        if key == 'source':
+            mtime, _, source = value.partition(' ')
+            data['sources'][source] = None if mtime == 'None' else float(mtime)
+        elif key == 'pending':
+            data['pending'] = value.split()
+        else:
+            data[key] = int(value)
+    return data
+
+
+def status(path: str = None, today: str = None) -> dict:
+    """Calculate current status from snapshot.
+
+    Contacts whose trigger date has passed since the snapshot was written are
+    counted as due, matching the live calculation.
+
+    Args:
+        path: Location of snapshot file, default location if not specified
+        today: ISO-8601 date to check against, current UTC date if not
+            specified
+
+    Returns:
+        Keys of ``due``, ``missing``, ``next`` trigger date and ``stale``
+    """
+    data = read(path or snapshot_path())
+    if not today:
+        today = time.strftime('%Y-%m-%d', time.gmtime())
+    passed = [date for date in data['pending'] if today > date]
+    upcoming = data['pending'][len(passed):]
+    current = source_mtimes(data['sources'])
+    return {
+        'due': data['due'] + len(passed),
+        'missing': data['missing'],
+        'next': upcoming[0] if upcoming else None,
+        'stale': current != data['sources'],
+    }
+
+
+def report(path: str = None) -> int:
+    """Display number of contacts with mail due from snapshot.
+
+    Args:
+        path: Location of snapshot file, default location if not specified
+
+    Returns:
+        Exit code
+    """
+    try:
+        state = status(path)
+    except FileNotFoundError:
+        print('No status snapshot found, run blanco with --snapshot first',
+              file=sys.stderr)
+        return errno.ENOENT
+    except ValueError as e:
+        print(e.args[0], file=sys.stderr)
+        return errno.EINVAL
+    if state['stale']:
+        print(f"{state['due']} (stale)")
+    else:
+        print(state['due'])
+    return 0
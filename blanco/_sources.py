@@ -0,0 +1,566 @@
+#
+"""_sources - Sent mail source interface and backend registry."""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import datetime
+import hashlib
+import importlib
+import itertools
+import os
+import pathlib
+import time
+
+from functools import lru_cache
+from typing import (AsyncIterator, Dict, Iterator, List, NamedTuple, Optional,
+                    Set, Tuple, Type, Union)
+
+from jnrbase import xdg_basedir
+
+from ._index import (CompactIndex, SentIndex, load_state, save_state)
+
+#: Entry point group for sent source backends
+ENTRY_POINT_GROUP = 'blanco.sources'
+
+#: Backends shipped with blanco, always available even without package
+#: metadata
+BUILTIN_SOURCES = {
+    'mailbox': 'blanco._mailbox:MailboxSource',
+    'msmtp': 'blanco._msmtp:MsmtpSource',
+    'imap': 'blanco._imap:IMAPSource',
+}
+
+
+def address_filter(
+        addresses: Optional[Union[str, List[str]]]) -> Optional[Set[str]]:
+    """Prepare address filter for fast lookups.
+
+    Args:
+        addresses: Addresses to look for in sent mail
+
+    Returns:
+        Addresses to look for, or `None` for all addresses
+    """
+    if not addresses:
+        return None
+    elif isinstance(addresses, str):
+        return {addresses}
+    else:
+        return set(addresses)
+
+
+class SentRecord(NamedTuple):
+    """Recipient of a sent message."""
+
+    #: Recipient address
+    address: str
+    #: Date mail was sent
+    date: datetime.date
+    #: Message key in a mailbox, line number or byte offset in a log, or
+    #: `None` for sources that only store aggregated data
+    position: Optional[Union[int, str]]
+
+
+def new_index(all_recipients: bool,
+              addresses: Optional[List[str]]) -> SentIndex:
+    """Create an index suited to the size of a scan.
+
+    Unfiltered scans of all recipients can see millions of list addresses,
+    so they use :class:`CompactIndex`, which packs large indexes and spills
+    their address buffer to the user’s cache directory.
+
+    Args:
+        all_recipients: Whether CC and BCC addresses are included
+        addresses: Addresses to look for, all if not specified
+
+    Returns:
+        Empty index
+    """
+    if all_recipients and not addresses:
+        return CompactIndex(
+            spill=pathlib.Path(xdg_basedir.user_cache('blanco')) / 'spill')
+    return SentIndex()
+
+
+async def aiter_records(records: Iterator[SentRecord],
+                        chunk_size: int) -> AsyncIterator[SentRecord]:
+    """Step through blocking record iterator from an event loop.
+
+    Records are read in a worker thread, a chunk at a time to amortise the
+    cost of handing off between threads.
+
+    Args:
+        records: Recipient records
+        chunk_size: Number of records to read in each step
+
+    Yields:
+        Recipient records
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        chunk = await loop.run_in_executor(
+            None, list, itertools.islice(records, chunk_size))
+        if not chunk:
+            return
+        for record in chunk:
+            yield record
+
+
+class Capabilities(NamedTuple):
+    """Features supported by a sent source backend."""
+
+    #: Order records are produced in, ``'oldest'`` or ``'newest'`` first, or
+    #: `None` if unordered
+    ordering: Optional[str] = None
+    #: Whether later runs can resume from a checkpoint
+    incremental: bool = False
+    #: Whether reading can be spread over several threads
+    parallel: bool = False
+    #: Whether scans can stop at a deadline and resume, see
+    #: :meth:`SentSource.newest_records`
+    bounded: bool = False
+
+
+class Position(NamedTuple):
+    """Location of a message in a sent source."""
+
+    #: Message key in a mailbox, or byte offset in a log
+    position: Union[int, str]
+    #: Date the message was sent, if the source needs it to resume reading
+    date: Optional[datetime.date] = None
+
+
+class Deadline:
+    """Time budget for a scan.
+
+    Sources record each message they finish reading with :meth:`mark`, so
+    progress is known even when no message matches the addresses being
+    looked for.
+
+    Args:
+        seconds: Time allowed for the scan
+    """
+
+    def __init__(self, seconds: float):
+        """Initialise a new `Deadline` object."""
+        self.end = time.monotonic() + seconds
+        self.expired = False
+        #: First message read since the last :meth:`reset`
+        self.first: Optional[Position] = None
+        #: Last message read since the last :meth:`reset`
+        self.last: Optional[Position] = None
+
+    def __repr__(self) -> str:
+        """Self-documenting string representation."""
+        return '{}(end={!r}, expired={!r})'.format(self.__class__.__name__,
+                                                   self.end, self.expired)
+
+    def check(self) -> bool:
+        """Check whether the budget has run out.
+
+        Once expired a deadline stays expired, so callers can inspect
+        :attr:`expired` after a scan to find out whether it was cut short.
+
+        Returns:
+            `True` if the scan should stop
+        """
+        if not self.expired and time.monotonic() >= self.end:
+            self.expired = True
+        return self.expired
+
+    def mark(self, position: Union[int, str],
+             date: Optional[datetime.date] = None) -> None:
+        """Record that a message has been read in full.
+
+        Args:
+            position: Location of the message
+            date: Date the message was sent, for sources that need it to
+                resume reading
+        """
+        self.last = Position(position, date)
+        if self.first is None:
+            self.first = self.last
+
+    def reset(self) -> None:
+        """Forget messages read so far, keeping the time budget."""
+        self.first = self.last = None
+
+
+class SentSource:
+    """Base class for sent source backends.
+
+    Backends are registered in the ``blanco.sources`` entry point group, and
+    must implement :meth:`records`.  The other methods have defaults suitable
+    for file based sources.
+
+    Args:
+        location: Location of the sent source
+        options: Configuration, or command line, options
+    """
+
+    #: Configuration key for the source’s location
+    location_key = ''
+    #: Features supported by the backend
+    capabilities = Capabilities()
+    #: Configuration keys that change the results of reading the source
+    result_options: Tuple[str, ...] = ()
+
+    def __init__(self, location: Union[pathlib.Path, str],
+                 options: Dict[str, Union[bool, int, str]]):
+        """Initialise a new `SentSource` object."""
+        self.location = location
+        self.options = options
+
+    def __repr__(self) -> str:
+        """Self-documenting string representation."""
+        return '{}({!r})'.format(self.__class__.__name__, self.location)
+
+    @classmethod
+    def from_options(cls, options: Dict[str, Union[bool, int, str]]
+                     ) -> 'SentSource':
+        """Create a source from configuration options.
+
+        Args:
+            options: Configuration, or command line, options
+
+        Returns:
+            Sent source
+        """
+        location = pathlib.Path(options[cls.location_key]).expanduser()
+        return cls(location, options)
+
+    def identity(self) -> Tuple:
+        """Identify the data this source reads.
+
+        Sources with equal identities produce identical results, so a single
+        read can be shared between them.
+
+        Returns:
+            Hashable identity
+        """
+        location = self.location
+        if isinstance(location, pathlib.Path):
+            location = location.resolve()
+        return (self.__class__, location) \
+            + tuple(self.options.get(key) for key in self.result_options)
+
+    def size(self) -> int:
+        """Estimate the amount of work needed to read the source.
+
+        Returns:
+            Size of file, or number of directory entries
+        """
+        path = self.location
+        if not path.is_dir():
+            return path.stat().st_size if path.exists() else 0
+        return sum(
+            sum(1 for _ in os.scandir(d))
+            for d in (path, path / 'new', path / 'cur') if d.is_dir())
+
+    def changes_path(self) -> pathlib.Path:
+        """Find the local file that changes along with the source.
+
+        Returns:
+            Location to check for changes
+        """
+        return self.location
+
+    def fingerprint(self, position: Union[int, str]) -> Optional[str]:
+        """Identify the message at a position.
+
+        Checkpoints store the fingerprint of the newest message read, so a
+        scan can tell when positions have been invalidated by the source
+        being rotated, packed or rewritten.  Bounded backends should override
+        this, the default can’t detect any changes.
+
+        Args:
+            position: Location of the message
+
+        Returns:
+            Digest of the message, or `None` if there is no message there
+        """
+        return None
+
+    def records(self,
+                all_recipients: bool = False,
+                addresses: List[str] = None) -> Iterator[SentRecord]:
+        """Iterate over recipients in the source.
+
+        Args:
+            all_recipients: Whether to include CC and BCC addresses in
+                results, or just the first
+            addresses: Addresses to look for in sent mail, all if not
+                specified
+
+        Returns:
+            Recipient records
+        """
+        raise NotImplementedError
+
+    def newest_records(self,
+                       all_recipients: bool = False,
+                       addresses: List[str] = None,
+                       after: Optional[Position] = None,
+                       before: Optional[Position] = None,
+                       deadline: Optional[Deadline] = None
+                       ) -> Iterator[SentRecord]:
+        """Iterate over recipients in the source, newest first.
+
+        Backends that implement this should set ``bounded`` in their
+        :attr:`capabilities`.
+
+        Args:
+            all_recipients: Whether to include CC and BCC addresses in
+                results, or just the first
+            addresses: Addresses to look for in sent mail, all if not
+                specified
+            after: Only read messages newer than this position
+            before: Only read messages older than this position
+            deadline: Stop reading when this expires, messages that are
+                read in full are recorded with :meth:`Deadline.mark`
+
+        Returns:
+            Recipient records
+        """
+        raise NotImplementedError
+
+    def arecords(self,
+                 all_recipients: bool = False,
+                 addresses: List[str] = None,
+                 chunk_size: int = 256) -> AsyncIterator[SentRecord]:
+        """Asynchronously iterate over recipients in the source.
+
+        Args:
+            all_recipients: Whether to include CC and BCC addresses in
+                results, or just the first
+            addresses: Addresses to look for in sent mail, all if not
+                specified
+            chunk_size: Number of records to read in each step
+
+        Returns:
+            Recipient records
+        """
+        return aiter_records(self.records(all_recipients, addresses),
+                             chunk_size)
+
+    def read(self,
+             all_recipients: bool = False,
+             addresses: List[str] = None) -> SentIndex:
+        """Read the source in to an index.
+
+        Args:
+            all_recipients: Whether to include CC and BCC addresses in
+                results, or just the first
+            addresses: Addresses to look for in sent mail, all if not
+                specified
+
+        Returns:
+            Keys of email address, and values of seen date
+        """
+        index = new_index(all_recipients, addresses)
+        for address, date, _ in self.records(all_recipients, addresses):
+            index.update(address, date)
+        return index
+
+
+@lru_cache()
+def available_sources() -> Dict[str, str]:
+    """Find installed sent source backends.
+
+    Only package metadata is read, backend modules are not imported.
+
+    Returns:
+        Keys of sent source type, and values of entry point reference
+    """
+    try:
+        from importlib import metadata
+    except ImportError:  # pragma: no cover
+        import importlib_metadata as metadata
+
+    sources = dict(BUILTIN_SOURCES)
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        group = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:  # pragma: no cover
+        group = entry_points.get(ENTRY_POINT_GROUP, [])
+    for entry_point in group:
+        sources.setdefault(entry_point.name, entry_point.value)
+    return sources
+
+
+def load_source(name: str) -> Type[SentSource]:
+    """Import a sent source backend.
+
+    Args:
+        name: Sent source type
+
+    Returns:
+        Backend class
+
+    Raises:
+        ValueError: Unknown sent source type
+    """
+    # Avoid reading package metadata at all for the common case
+    reference = BUILTIN_SOURCES.get(name) or available_sources().get(name)
+    if not reference:
+        raise ValueError(f'Unknown sent source type ‘{name}’')
+    module, _, attr = reference.partition(':')
+    obj = importlib.import_module(module)
+    for part in attr.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def checkpoint_path(source: SentSource, all_recipients: bool,
+                    addresses: Optional[List[str]]) -> pathlib.Path:
+    """Location of the checkpoint for a deadline-bounded scan.
+
+    Args:
+        source: Sent source
+        all_recipients: Whether CC and BCC addresses are included
+        addresses: Addresses to look for, all if not specified
+
+    Returns:
+        Checkpoint file path
+    """
+    key = repr((source.identity(), all_recipients,
+                sorted(address_filter(addresses) or ())))
+    return pathlib.Path(xdg_basedir.user_cache('blanco')) / 'checkpoints' \
+        / hashlib.sha1(key.encode()).hexdigest()
+
+
+def _load_position(data: Optional[List]) -> Optional[Position]:
+    """Rebuild a position stored in a checkpoint.
+
+    Args:
+        data: Message location and date ordinal
+
+    Returns:
+        Message position
+    """
+    if data is None:
+        return None
+    position, ordinal = data
+    return Position(position,
+                    datetime.date.fromordinal(ordinal) if ordinal else None)
+
+
+def _dump_position(position: Optional[Position]) -> Optional[List]:
+    """Prepare a position for storing in a checkpoint.
+
+    Args:
+        position: Message position
+
+    Returns:
+        Message location and date ordinal
+    """
+    if position is None:
+        return None
+    return [position.position,
+            position.date.toordinal() if position.date else None]
+
+
+def scan(source: SentSource,
+         all_recipients: bool,
+         addresses: Optional[List[str]],
+         deadline: Deadline,
+         checkpoint: Optional[pathlib.Path] = None) -> SentIndex:
+    """Read a source newest first, stopping when the deadline expires.
+
+    When a checkpoint is given the results so far, the newest message read
+    and the gaps left unread are stored there.  The next scan reads any newer
+    mail first, and then fills the gaps newest first.  Progress is measured
+    in messages read rather than records found, so scans for a few addresses
+    still move forward.  Completed scans keep their checkpoint, so later
+    runs only read new mail.
+
+    Positions are only meaningful while the source is appended to, so the
+    checkpoint is thrown away when the :meth:`~SentSource.fingerprint` of its
+    newest message no longer matches, for example after a log is rotated or a
+    MH folder is packed.
+
+    Args:
+        source: Bounded sent source
+        all_recipients: Whether to include CC and BCC addresses in
+            results, or just the first
+        addresses: Addresses to look for in sent mail, all if not
+            specified
+        deadline: Time budget for the scan, check its ``expired`` attribute
+            to find out whether the results are complete
+        checkpoint: Location to store progress in
+
+    Returns:
+        Keys of email address, and values of seen date
+    """
+    index = new_index(all_recipients, addresses)
+    state = load_state(checkpoint, ('sent', )) if checkpoint else None
+    top = None
+    gaps: List[Tuple[Optional[Position], Optional[Position]]] = []
+    if state:
+        try:
+            top = _load_position(state['top'])
+            gaps = [(_load_position(before), _load_position(after))
+                    for before, after in state['gaps']]
+        except (KeyError, TypeError, ValueError):
+            top, gaps = None, []
+        if top and state.get('check') != source.fingerprint(top.position):
+            top, gaps = None, []
+        if top:
+            index.merge(state['sent'])
+
+    # Mail newer than the checkpoint is read first, as it is the most useful
+    pending = [(None, top)] + gaps
+    gaps = []
+    for number, (before, after) in enumerate(pending):
+        deadline.reset()
+        for record in source.newest_records(all_recipients, addresses,
+                                            after=after, before=before,
+                                            deadline=deadline):
+            index.update(record.address, record.date)
+        if before is None:
+            top = deadline.first or top
+        if deadline.expired:
+            if deadline.last:
+                gaps.append((deadline.last, after))
+            elif before is not None:
+                gaps.append((before, after))
+            gaps.extend(pending[number + 1:])
+            break
+
+    if checkpoint and top:
+        save_state(checkpoint, {
+            'top': _dump_position(top),
+            'gaps': [(_dump_position(before), _dump_position(after))
+                     for before, after in gaps],
+            'sent': index,
+            'check': source.fingerprint(top.position),
+        }, ('sent', ))
+    return index
+
+
+def open_source(name: str,
+                options: Dict[str, Union[bool, int, str]]) -> SentSource:
+    """Create a sent source of the given type.
+
+    Args:
+        name: Sent source type
+        options: Configuration, or command line, options
+
+    Returns:
+        Sent source
+    """
+    return load_source(name).from_options(options)
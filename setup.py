@@ -58,9 +58,17 @@ setup(
         'blanco',
     ],
     include_package_data=True,
-    entry_points={'console_scripts': [
-        'blanco = blanco:main',
-    ]},
+    entry_points={
+        'console_scripts': [
+            'blanco = blanco:run',
+        ],
+        'blanco.sources': [
+            'imap = blanco._imap:IMAPSource',
+            'mailbox = blanco._mailbox:MailboxSource',
+            'msmtp = blanco._msmtp:MsmtpSource',
+        ],
+    },
+    python_requires='>=3.7',
     install_requires=install_requires,
     tests_require=['pytest'],
     cmdclass={'test': PytestTest},
@@ -77,7 +85,6 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Topic :: Communications :: Email',
         'Topic :: Communications :: Email :: Address Book',
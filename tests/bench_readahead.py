@@ -0,0 +1,92 @@
+#
+"""bench_readahead - Benchmark read-ahead on high latency filesystems"""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Run with ``python -m tests.bench_readahead`` from the top of the tree.  Each
+# message read sleeps for the given latency, standing in for an NFS round
+# trip, so the numbers mostly reflect how well the reads overlap.
+
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import click
+
+from blanco import (_mailbox, iter_sent)
+
+
+def make_maildir(path: Path, messages: int) -> Path:
+    """Fill a maildir with copies of the test messages.
+
+    Args:
+        path: Location to create maildir in
+        messages: Number of messages to create
+
+    Returns:
+        Location of the new maildir
+    """
+    maildir = path / 'sent.maildir'
+    for sub in ('cur', 'new', 'tmp'):
+        (maildir / sub).mkdir(parents=True)
+    sources = sorted(Path('tests/data/sent.maildir/new').iterdir())
+    for n in range(messages):
+        shutil.copy(sources[n % len(sources)],
+                    maildir / 'new' / f'{1265781656 + n}.M{n}P1.bench')
+    return maildir
+
+
+@click.command()
+@click.option('-m', '--messages', default=500, help='Messages to create.')
+@click.option('-l', '--latency', default=0.002,
+              help='Simulated latency per read, in seconds.')
+@click.option('-w', '--workers', default=[2, 4, 8, 16], multiple=True,
+              help='Read-ahead threads to test, may be repeated.')
+@click.option('-d', '--depth', default=0,
+              help='Maximum number of messages to read ahead.')
+def main(messages: int, latency: float, workers: List[int], depth: int):
+    """Compare serial and read-ahead maildir scans."""
+    read_headers = _mailbox._read_headers
+
+    def slow_read_headers(path):
+        time.sleep(latency)
+        return read_headers(path)
+
+    _mailbox._read_headers = slow_read_headers
+    with tempfile.TemporaryDirectory() as tmp:
+        maildir = make_maildir(Path(tmp), messages)
+        expected = list(iter_sent(maildir, True))
+        # A single read in flight gives the serial cost with the same latency
+        start = time.perf_counter()
+        list(iter_sent(maildir, True, workers=1, depth=1))
+        serial = time.perf_counter() - start
+        click.echo(f'serial: {serial:.3f}s')
+        for count in workers:
+            start = time.perf_counter()
+            records = list(iter_sent(maildir, True, workers=count,
+                                     depth=depth))
+            elapsed = time.perf_counter() - start
+            if records != expected:
+                raise click.ClickException(f'Results differ with {count} '
+                                           'workers')
+            click.echo(f'{count} workers: {elapsed:.3f}s '
+                       f'({serial / elapsed:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
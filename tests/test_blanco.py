@@ -16,20 +16,44 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import asyncio
+import errno
+import os
+import shutil
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from configparser import MissingSectionHeaderError
-from datetime import date
+from datetime import (date, datetime)
 from pathlib import Path
 from typing import Dict, List, Optional
 
 from hiro import Timeline
 from pytest import (mark, raises)
 
-from blanco import (Contact, Contacts, notify2, parse_msmtp, parse_sent,
-                    process_config, show_note)
+from blanco import (Contact, Contacts, Deadline, Position, SentRecord,
+                    _mailbox, aiter_msmtp, aiter_sent, contact_reports,
+                    contact_status, iter_mh, iter_msmtp, iter_msmtp_newest,
+                    iter_sent, mh_sequences, notify2, parse_msmtp, parse_sent,
+                    process_config, process_manifest, read_ahead, read_sent,
+                    run_batch, show_note, sync_mh)
 
 TEST_CONTACT = Contact('James Rowe', 'jnrowe@gmail.com', 200)
 TEST_CONTACT2 = Contact(
     'James Rowe', ['jnrowe@gmail.com', 'jnrowe@example.com'], 200, 'james.png')
+BATCH_DEFAULTS = {
+    'addressbook': 'tests/data/blanco.conf',
+    'sent type': 'mailbox',
+    'all': False,
+    'mbox': 'tests/data/sent.mbox',
+    'mh sequence': '',
+    'read ahead': 0,
+    'read ahead depth': 0,
+    'log': 'tests/data/sent.msmtp',
+    'gmail': False,
+    'field': 'frequency',
+}
 
 
 class MockNotification:
@@ -88,6 +112,137 @@ def test_parse_sent(mbox: str, recipients: bool, addresses: Optional[str],
         == result
 
 
+def test_iter_sent():
+    records = iter_sent(Path('tests/data/sent.mh'), True)
+    assert next(records) == SentRecord('test@example.com', date(2010, 2, 9),
+                                       1)
+    assert [r.position for r in records] == [2, 2, 2, 3]
+
+
+def test_iter_sent_missing_mailbox(tmpdir):
+    # Errors are raised immediately, not on first iteration
+    with raises(IOError):
+        iter_sent(Path(tmpdir.join('no_such_file')))
+
+
+def test_aiter_sent():
+    async def collect():
+        return [r async for r in aiter_sent(Path('tests/data/sent.mh'), True,
+                                            chunk_size=2)]
+
+    assert asyncio.run(collect()) == \
+        list(iter_sent(Path('tests/data/sent.mh'), True))
+
+
+def test_iter_mh():
+    records = iter_mh(Path('tests/data/sent.mh'), True)
+    assert [r.position for r in records] == [3, 2, 2, 2, 1]
+
+
+def test_iter_mh_skip():
+    records = iter_mh(Path('tests/data/sent.mh'), skip={2, 3})
+    assert list(records) == [
+        SentRecord('test@example.com', date(2010, 2, 9), 1),
+    ]
+
+
+def test_mh_sequences(tmpdir):
+    tmpdir.join('.mh_sequences').write('unseen: 1-3 5\nblanco: 4\n')
+    assert mh_sequences(Path(tmpdir.strpath)) == {
+        'unseen': {1, 2, 3, 5},
+        'blanco': {4},
+    }
+
+
+def test_sync_mh(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', tmpdir.join('cache').strpath)
+    path = Path(tmpdir.join('sent.mh'))
+    shutil.copytree('tests/data/sent.mh', path)
+    state = sync_mh(path, 'blanco')
+    assert mh_sequences(path)['blanco'] == {1, 2, 3}
+    assert state['all'] == parse_sent(Path('tests/data/sent.mh'), True)
+    # Recorded messages are skipped, unless their file changes
+    reads = []
+    read = _mailbox._try_read_headers
+    monkeypatch.setattr(_mailbox, '_try_read_headers',
+                        lambda name: reads.append(name) or read(name))
+    assert sync_mh(path, 'blanco') == state
+    assert reads == []
+    path.joinpath('1').write_text('To: new@example.com\n'
+                                  'Date: Tue, 09 Feb 2010 12:13:47 +0000\n\n')
+    state = sync_mh(path, 'blanco')
+    assert reads == [path.joinpath('1').as_posix()]
+    assert state['all']['new@example.com'] == date(2010, 2, 9)
+
+
+@mark.parametrize('recipients, addresses', [
+    (True, None),
+    (False, None),
+    (True, ['max@example.com']),
+])
+def test_parse_sent_mh_sequence(recipients: bool,
+                                addresses: Optional[List[str]], tmpdir,
+                                monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', tmpdir.join('cache').strpath)
+    path = Path(tmpdir.join('sent.mh'))
+    shutil.copytree('tests/data/sent.mh', path)
+    for _ in range(2):
+        assert parse_sent(path, recipients, addresses, sequence='blanco') \
+            == parse_sent(Path('tests/data/sent.mh'), recipients, addresses)
+
+
+def test_parse_sent_unusable_date(tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', tmpdir.join('cache').strpath)
+    path = Path(tmpdir.join('sent.mh'))
+    shutil.copytree('tests/data/sent.mh', path)
+    path.joinpath('4').write_text('To: new@example.com\nDate: soon\n\n')
+    expected = parse_sent(Path('tests/data/sent.mh'), True)
+    assert parse_sent(path, True) == expected
+    assert parse_sent(path, True, sequence='blanco') == expected
+
+
+def test_read_ahead():
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def read(n: int) -> int:
+        with lock:
+            active.append(n)
+            peak.append(len(active))
+        time.sleep(0.001)
+        with lock:
+            active.remove(n)
+        return n * n
+
+    assert list(read_ahead(range(40), read, 4, 6)) == \
+        [n * n for n in range(40)]
+    assert 1 < max(peak) <= 4
+
+
+def test_read_ahead_bounded():
+    started = []
+
+    def read(n: int) -> int:
+        started.append(n)
+        time.sleep(0.01)
+        return n
+
+    results = read_ahead(range(100), read, 2, 4)
+    assert next(results) == 0
+    results.close()
+    # The initial queue and a single refill, queued reads are cancelled
+    assert len(started) <= 5
+
+
+@mark.parametrize('mbox', ['sent.maildir', 'sent.mh'])
+@mark.parametrize('recipients', [True, False])
+def test_iter_sent_read_ahead(mbox: str, recipients: bool):
+    path = Path('tests/data') / mbox
+    assert list(iter_sent(path, recipients, workers=3, depth=2)) == \
+        list(iter_sent(path, recipients))
+
+
 def test_missing_msmtp_log(tmpdir):
     with raises(IOError) as err:
         parse_msmtp(Path(tmpdir.join('no_such_file')))
@@ -127,6 +282,60 @@ def test_parse_msmtp(log: str, all_recipients: bool,
             gmail) == result
 
 
+def test_iter_msmtp_years(tmpdir):
+    log = tmpdir.join('sent.msmtp')
+    log.write(''.join(
+        f'{d} 12:13:47 recipients={a}@example.com exitcode=EX_OK\n'
+        for d, a in [('Dec 30', 'joe'), ('Jan 02', 'max'), ('Feb 09', 'joe')]))
+    mtime = datetime(2014, 3, 1).timestamp()
+    os.utime(log.strpath, (mtime, mtime))
+    assert list(iter_msmtp(Path(log))) == [
+        SentRecord('joe@example.com', date(2013, 12, 30), 1),
+        SentRecord('max@example.com', date(2014, 1, 2), 2),
+        SentRecord('joe@example.com', date(2014, 2, 9), 3),
+    ]
+
+
+def test_iter_msmtp_newest_years(tmpdir):
+    log = tmpdir.join('sent.msmtp')
+    log.write(''.join(
+        f'{d} 12:13:47 recipients={a}@example.com exitcode=EX_OK\n'
+        for d, a in [('Dec 30', 'joe'), ('Jan 02', 'max'), ('Feb 09', 'joe')]))
+    mtime = datetime(2014, 3, 1).timestamp()
+    os.utime(log.strpath, (mtime, mtime))
+    records = list(iter_msmtp_newest(Path(log)))
+    assert [r[:2] for r in records] == [
+        ('joe@example.com', date(2014, 2, 9)),
+        ('max@example.com', date(2014, 1, 2)),
+        ('joe@example.com', date(2013, 12, 30)),
+    ]
+    # Resuming takes the year from the entry the scan stopped at
+    stop = Position(records[1].position, records[1].date)
+    assert list(iter_msmtp_newest(Path(log), before=stop)) == records[2:]
+
+
+def test_iter_msmtp_newest_truncated():
+    log = Path('tests/data/sent_gmail.msmtp')
+    # Positions past the end of the log are from before it was truncated
+    after = Position(log.stat().st_size + 100)
+    assert list(iter_msmtp_newest(log, True, gmail=True, after=after)) \
+        == list(iter_msmtp_newest(log, True, gmail=True))
+
+
+def test_parse_msmtp_deadline():
+    assert parse_msmtp(Path('tests/data/sent_gmail.msmtp'), True, gmail=True,
+                       deadline=Deadline(0)) == {}
+
+
+def test_aiter_msmtp():
+    async def collect():
+        return [r async for r in aiter_msmtp(
+            Path('tests/data/sent_gmail.msmtp'), True, gmail=True)]
+
+    assert asyncio.run(collect()) == \
+        list(iter_msmtp(Path('tests/data/sent_gmail.msmtp'), True, gmail=True))
+
+
 def test_parse_msmtp_invalid_gmail():
     with Timeline().freeze(date(2014, 6, 27)):
         with raises(ValueError) as err:
@@ -157,6 +366,88 @@ def test_process_config_invalid_types(monkeypatch):
     assert str(err.value) == "Config value for 'colour' must be a bool"
 
 
+def test_process_manifest():
+    profiles = process_manifest(Path('tests/data/batch.ini'), BATCH_DEFAULTS)
+    assert list(profiles) == ['maildir', 'msmtp', 'maildir copy']
+    assert profiles['maildir']['mbox'] == 'tests/data/sent.maildir'
+    assert profiles['maildir']['all'] is False
+    assert profiles['msmtp']['sent type'] == 'msmtp'
+    assert profiles['msmtp']['field'] == 'frequency'
+
+
+def test_process_manifest_percent():
+    url = 'imaps://me%40example.com@example.com/Sent'
+    profiles = process_manifest(Path('tests/data/batch.ini'),
+                                dict(BATCH_DEFAULTS, imap=url))
+    assert profiles['maildir']['imap'] == url
+
+
+def test_process_manifest_missing(tmpdir):
+    with raises(IOError) as err:
+        process_manifest(Path(tmpdir.join('no_such_file')), BATCH_DEFAULTS)
+    assert str(err.value).endswith(' not found')
+
+
+def test_process_manifest_invalid_sent_type(tmpdir):
+    manifest = tmpdir.join('batch.ini')
+    manifest.write('[pigeon]\nsent type = carrier\n')
+    with raises(ValueError) as err:
+        process_manifest(Path(manifest), BATCH_DEFAULTS)
+    assert str(err.value) == "Unknown sent type for profile 'pigeon'"
+
+
+def test_run_batch(monkeypatch, capsys):
+    calls = []
+
+    def counting_read_sent(*args):
+        calls.append(args)
+        return read_sent(*args)
+
+    monkeypatch.setattr('blanco._core.ProcessPoolExecutor',
+                        ThreadPoolExecutor)
+    monkeypatch.setattr('blanco._core.read_sent', counting_read_sent)
+    profiles = process_manifest(Path('tests/data/batch.ini'), BATCH_DEFAULTS)
+    assert run_batch(profiles, False) is None
+    # The maildir profiles share a single parse
+    assert len(calls) == 2
+    _, err = capsys.readouterr()
+    assert err.index('maildir:') < err.index('msmtp:') \
+        < err.index('maildir copy:')
+    assert err.count('Mail due for Bill') == 3
+
+
+def test_run_batch_process_pool(capsys):
+    profiles = process_manifest(Path('tests/data/batch.ini'), BATCH_DEFAULTS)
+    assert run_batch(profiles, False, jobs=2) is None
+    _, err = capsys.readouterr()
+    assert err.count('Mail due for Joe') == 3
+
+
+def test_run_batch_missing_source(tmpdir, capsys, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', tmpdir.strpath)
+    profiles = process_manifest(Path('tests/data/batch.ini'), BATCH_DEFAULTS)
+    profiles['msmtp']['log'] = tmpdir.join('no_such_file').strpath
+    assert run_batch(profiles, False, True, jobs=1) == errno.EPERM
+    _, err = capsys.readouterr()
+    assert 'msmtp sent log' in err
+    assert err.count('Mail due for Joe') == 2
+    # Counts would be missing the failed profile
+    assert not tmpdir.join('blanco', 'status').exists()
+
+
+def test_run_batch_gmail_mismatch(tmpdir, capsys, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', tmpdir.strpath)
+    profiles = process_manifest(Path('tests/data/batch.ini'),
+                                dict(BATCH_DEFAULTS, gmail=True))
+    assert run_batch(profiles, False, True, jobs=1) == errno.EPERM
+    _, err = capsys.readouterr()
+    assert 'not in gmail format' in err
+    # Profiles after the failure are still checked
+    assert err.index('msmtp:') < err.index('maildir copy:')
+    assert err.count('Mail due for Joe') == 2
+    assert not tmpdir.join('blanco', 'status').exists()
+
+
 @mark.parametrize('urgency', [
     notify2.URGENCY_NORMAL,
     notify2.URGENCY_CRITICAL,
@@ -235,6 +526,39 @@ def test_trigger():
     }) == date(1942, 7, 20)
 
 
+@mark.parametrize('sent, complete, expected', [
+    ({}, True, ('missing', None)),
+    ({}, False, ('unknown', None)),
+    ({'jnrowe@gmail.com': date(2014, 1, 1)}, True,
+     ('due', date(2014, 7, 20))),
+    ({'jnrowe@gmail.com': date(2014, 1, 1)}, False,
+     ('due', date(2014, 7, 20))),
+    ({'jnrowe@gmail.com': date(2014, 6, 1)}, True,
+     ('pending', date(2014, 12, 18))),
+    ({'jnrowe@gmail.com': date(2014, 6, 1)}, False, ('unknown', None)),
+    ({'jnrowe@gmail.com': date(2014, 6, 1),
+      'jnrowe@example.com': date(2014, 5, 1)}, False,
+     ('pending', date(2014, 11, 17))),
+])
+def test_contact_status(sent: Dict[str, date], complete: bool,
+                        expected: tuple):
+    assert contact_status(TEST_CONTACT2, sent, date(2014, 7, 21),
+                          complete) == expected
+
+
+def test_contact_reports():
+    sent = {'jnrowe@gmail.com': date(2014, 6, 1),
+            'jnrowe@example.com': date(2014, 5, 1)}
+    with Timeline().freeze(datetime(2014, 11, 20)):
+        contacts = [TEST_CONTACT2, Contact('Bill', 'test@example.com', 30)]
+        reports = list(contact_reports(contacts, sent, False))
+    assert reports == [
+        ('James Rowe', ('jnrowe@gmail.com', 'jnrowe@example.com'),
+         date(2014, 5, 1), date(2014, 11, 17), 3, 'due'),
+        ('Bill', ('test@example.com', ), None, None, None, 'unknown'),
+    ]
+
+
 @mark.parametrize('server_caps, expected', [
     ([], 'James Rowe'),
     (['body-hyperlinks'], "<a href='mailto:jnrowe@gmail.com'>James Rowe</a>"),
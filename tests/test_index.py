@@ -0,0 +1,185 @@
+#
+"""test_index - Test sent mail index functionality"""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import pickle
+from datetime import date
+from pathlib import Path
+
+from pytest import (fixture, mark)
+
+from blanco import (CompactIndex, SentIndex, decode_addresses, decode_date,
+                    header_cache_clear, header_cache_info, parse_msmtp,
+                    parse_sent)
+
+
+@fixture(params=['dict', 'compact', 'packed'])
+def index(request, monkeypatch):
+    if request.param == 'packed':
+        monkeypatch.setattr(CompactIndex, 'COMPACT_SIZE', 0)
+    cls = SentIndex if request.param == 'dict' else CompactIndex
+    return cls({
+        'joe@example.com': date(2000, 2, 9),
+        'max@example.com': date(2010, 2, 9),
+    })
+
+
+def test_update(index):
+    index.update('joe@example.com', date(1999, 1, 1))
+    index.update('max@example.com', date(2014, 6, 27))
+    index.update('test@example.com', date(2013, 2, 9))
+    assert index == {
+        'joe@example.com': date(2000, 2, 9),
+        'max@example.com': date(2014, 6, 27),
+        'test@example.com': date(2013, 2, 9),
+    }
+
+
+def test_mapping(index):
+    assert 'joe@example.com' in index
+    assert 'nobody@example.com' not in index
+    assert index['max@example.com'] == date(2010, 2, 9)
+    assert index.get('nobody@example.com') is None
+    assert len(index) == 2
+    assert sorted(index) == ['joe@example.com', 'max@example.com']
+
+
+def test___repr__(index):
+    assert repr(SentIndex({'joe@example.com': date(2000, 2, 9)})) == \
+        "SentIndex({'joe@example.com': datetime.date(2000, 2, 9)})"
+
+
+def test_merge(index):
+    a = SentIndex({'joe@example.com': date(2013, 2, 9)})
+    b = SentIndex({'max@example.com': date(2000, 2, 9)})
+    left = SentIndex(index).merge(a).merge(b)
+    right = SentIndex(index).merge(SentIndex(a).merge(b))
+    assert left == right == {
+        'joe@example.com': date(2013, 2, 9),
+        'max@example.com': date(2010, 2, 9),
+    }
+    assert SentIndex(a).merge(b) == SentIndex(b).merge(a)
+
+
+def test_subset(index):
+    assert index.subset(['joe@example.com', 'nobody@example.com']) == {
+        'joe@example.com': date(2000, 2, 9),
+    }
+
+
+def test_serialisation(index):
+    assert index.dumps() == \
+        '730159 joe@example.com\n733812 max@example.com'
+    assert SentIndex.loads(index.dumps()) == index
+    assert pickle.loads(pickle.dumps(index)) == index
+
+
+def test_parse_sent_index():
+    index = parse_sent(Path('tests/data/sent.mbox'))
+    assert isinstance(index, SentIndex)
+    assert parse_msmtp(Path('tests/data/sent_gmail.msmtp'), gmail=True,
+                       index=index) is index
+    assert index['test@example.com'] == date(2010, 2, 9)
+
+
+def test_compact_index_growth(monkeypatch):
+    monkeypatch.setattr(CompactIndex, 'COMPACT_SIZE', 100)
+    dates = {
+        f'user{n}@example.com': date.fromordinal(730000 + n)
+        for n in range(1000)
+    }
+    index = CompactIndex(dates)
+    assert index._dates is None
+    assert index == dates
+    assert 'nobody@example.com' not in index
+    assert CompactIndex().merge(SentIndex(dates)) == SentIndex().merge(index)
+
+
+def test_compact_index_small():
+    index = CompactIndex({'joe@example.com': date(2000, 2, 9)})
+    assert index._dates == {'joe@example.com': 730159}
+    assert len(index._values) == 0
+
+
+def test_compact_index_spill(index, monkeypatch, tmpdir):
+    monkeypatch.setattr(CompactIndex, 'COMPACT_SIZE', 0)
+    monkeypatch.setattr(CompactIndex, 'SPILL_SIZE', 16)
+    spill = tmpdir.join('spill')
+    spilled = CompactIndex(index, spill=spill.strpath)
+    spilled.update('jnrowe@example.com', date(2014, 6, 27))
+    assert len(spill.listdir()) == 0  # Unlinked temporary file
+    assert spilled['jnrowe@example.com'] == date(2014, 6, 27)
+    assert spilled == dict(index, **{'jnrowe@example.com': date(2014, 6, 27)})
+    assert pickle.loads(pickle.dumps(spilled)) == spilled
+
+
+@mark.parametrize('all_recipients, addresses, expected', [
+    (True, None, CompactIndex),
+    (False, None, SentIndex),
+    (True, ['max@example.com'], SentIndex),
+])
+def test_parse_sent_compact(all_recipients, addresses, expected):
+    path = Path('tests/data/sent.mbox')
+    index = parse_sent(path, all_recipients, addresses)
+    assert type(index) is expected
+    assert index == parse_sent(path, all_recipients, addresses, SentIndex())
+
+
+@mark.parametrize('values, expected', [
+    (['Joe <Joe@Example.com>'], ('joe@example.com', )),
+    (['joe@example.com, Max <max@example.com>', 'test@example.com'],
+     ('joe@example.com', 'max@example.com', 'test@example.com')),
+    ([], ()),
+])
+def test_decode_addresses(values, expected):
+    assert decode_addresses(values) == expected
+
+
+@mark.parametrize('value, expected', [
+    ('Tue, 09 Feb 2010 12:13:47 +0000', date(2010, 2, 9)),
+    ('Tue, 09 Feb 2010 23:59:01 -0500 (EST)', date(2010, 2, 9)),
+    ('Tue Feb 09 12:00:00 2010', date(2010, 2, 9)),
+    ('9 Feb 10 08:00 GMT', date(2010, 2, 9)),
+    ('09-Feb-2010 12:13:47 +0000', date(2010, 2, 9)),
+    ('Tue, 9 Feb 2010 12:13:47 EST5EDT', date(2010, 2, 9)),
+    ('not a date', None),
+    (None, None),
+])
+def test_decode_date(value, expected):
+    assert decode_date(value) == expected
+
+
+def test_decode_date_cache_same_day():
+    header_cache_clear()
+    for value in ('Tue, 09 Feb 2010 08:01:02 +0000',
+                  'Tue, 09 Feb 2010 12:13:47 -0500 (EST)',
+                  'Tue, 09 Feb 2010 23:59:59 +0100'):
+        assert decode_date(value) == date(2010, 2, 9)
+    info = header_cache_info()['dates']
+    assert (info.hits, info.misses) == (2, 1)
+
+
+def test_header_cache_info():
+    header_cache_clear()
+    parse_sent(Path('tests/data/sent.mh'), True)
+    first = header_cache_info()
+    assert first['addresses'].misses == 3
+    assert first['dates'].hits == 1
+    parse_sent(Path('tests/data/sent.mh'), True)
+    second = header_cache_info()
+    assert second['addresses'].hits == first['addresses'].hits + 3
+    assert second['dates'].misses == first['dates'].misses
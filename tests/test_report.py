@@ -0,0 +1,116 @@
+#
+"""test_report - Test machine-readable report functionality"""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import csv
+import io
+import json
+from datetime import date
+
+from pytest import (mark, raises)
+
+from blanco import _report
+
+REPORTS = [
+    _report.ContactReport('James Rowe',
+                          ('jnrowe@gmail.com', 'jnrowe@example.com'),
+                          date(2014, 1, 2), date(2014, 1, 1), 10, 'due'),
+    _report.ContactReport('Zoë', ('zoe@example.com', ), None, None, None,
+                          'missing'),
+]
+
+
+def test_write_json():
+    stream = io.BytesIO()
+    _report.write(REPORTS, 'json', stream)
+    assert json.loads(stream.getvalue().decode()) == [
+        {
+            'name': 'James Rowe',
+            'addresses': ['jnrowe@gmail.com', 'jnrowe@example.com'],
+            'last_sent': '2014-01-02',
+            'trigger': '2014-01-01',
+            'days_overdue': 10,
+            'status': 'due',
+        },
+        {
+            'name': 'Zoë',
+            'addresses': ['zoe@example.com'],
+            'last_sent': None,
+            'trigger': None,
+            'days_overdue': None,
+            'status': 'missing',
+        },
+    ]
+
+
+def test_write_ndjson():
+    stream = io.BytesIO()
+    _report.write(REPORTS, 'ndjson', stream)
+    lines = stream.getvalue().decode().splitlines()
+    assert [json.loads(line)['name'] for line in lines] \
+        == ['James Rowe', 'Zoë']
+
+
+def test_write_csv():
+    stream = io.BytesIO()
+    _report.write(REPORTS, 'csv', stream)
+    rows = list(csv.reader(io.StringIO(stream.getvalue().decode())))
+    assert rows == [
+        list(_report.ContactReport._fields),
+        ['James Rowe', 'jnrowe@gmail.com jnrowe@example.com', '2014-01-02',
+         '2014-01-01', '10', 'due'],
+        ['Zoë', 'zoe@example.com', '', '', '', 'missing'],
+    ]
+
+
+@mark.parametrize('fmt, expected', [
+    ('csv', 'name,addresses,last_sent,trigger,days_overdue,status\n'),
+    ('json', '[]\n'),
+    ('ndjson', ''),
+])
+def test_write_empty(fmt: str, expected: str):
+    stream = io.BytesIO()
+    assert _report.write([], fmt, stream) == {}
+    assert stream.getvalue().decode() == expected
+
+
+def test_write_summary():
+    stream = io.BytesIO()
+    assert _report.write(REPORTS, 'ndjson', stream) == {
+        'due': [date(2014, 1, 1)],
+        'missing': [None],
+    }
+    # The caller’s stream is left usable
+    assert not stream.closed
+
+
+def test_write_buffered(monkeypatch):
+    writes = []
+
+    class Stream(io.BytesIO):
+        def write(self, data):
+            writes.append(len(data))
+            return super().write(data)
+
+    _report.write(REPORTS * 500, 'ndjson', Stream())
+    assert len(writes) < 10
+
+
+def test_write_unknown_format():
+    with raises(ValueError) as err:
+        _report.write(REPORTS, 'yaml', io.BytesIO())
+    assert str(err.value) == 'Unknown report format ‘yaml’'
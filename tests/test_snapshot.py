@@ -0,0 +1,129 @@
+#
+"""test_snapshot - Test status snapshot functionality"""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import errno
+import os
+import subprocess
+import sys
+from datetime import date
+
+from pytest import (fixture, mark, raises)
+
+from blanco import _snapshot
+
+
+@fixture
+def snapshot(tmpdir):
+    source = tmpdir.join('sent.msmtp')
+    source.write('')
+    os.utime(source, (1000000000, 1000000000))
+    path = tmpdir.join('cache', 'status').strpath
+    _snapshot.write(path, 2, 1, [date(2014, 7, 2), date(2014, 6, 30)],
+                    [source.strpath])
+    return path, source
+
+
+def test_write_read(snapshot):
+    path, source = snapshot
+    assert _snapshot.read(path) == {
+        'due': 2,
+        'missing': 1,
+        'pending': ['2014-06-30', '2014-07-02'],
+        'sources': {
+            source.strpath: 1000000000,
+        },
+    }
+
+
+def test_source_mtimes_maildir(tmpdir):
+    for sub in ('cur', 'new', 'tmp'):
+        tmpdir.mkdir(sub)
+    assert set(_snapshot.source_mtimes([tmpdir.strpath])) == {
+        tmpdir.strpath,
+        tmpdir.join('new').strpath,
+        tmpdir.join('cur').strpath,
+    }
+
+
+def test_source_mtimes_missing(tmpdir):
+    missing = tmpdir.join('no_such_file').strpath
+    assert _snapshot.source_mtimes([missing]) == {missing: None}
+
+
+def test_read_version(tmpdir):
+    path = tmpdir.join('status')
+    path.write('blanco-status 0\ndue 0\n')
+    with raises(ValueError) as err:
+        _snapshot.read(path.strpath)
+    assert 'Unsupported status snapshot version' in str(err.value)
+
+
+@mark.parametrize('today, due, next', [
+    ('2014-06-27', 2, '2014-06-30'),
+    ('2014-06-30', 2, '2014-06-30'),
+    ('2014-07-01', 3, '2014-07-02'),
+    ('2014-07-03', 4, None),
+])
+def test_status(today: str, due: int, next: str, snapshot):
+    path, _ = snapshot
+    assert _snapshot.status(path, today) == {
+        'due': due,
+        'missing': 1,
+        'next': next,
+        'stale': False,
+    }
+
+
+def test_status_stale(snapshot):
+    path, source = snapshot
+    source.write('Feb 09 12:13:47 ...\n')
+    assert _snapshot.status(path, '2014-06-27')['stale'] is True
+
+
+def test_report(snapshot, capsys):
+    path, source = snapshot
+    assert _snapshot.report(path) == 0
+    out, _ = capsys.readouterr()
+    assert out.strip().isdigit()
+    source.write('')
+    _snapshot.report(path)
+    out, _ = capsys.readouterr()
+    assert out.endswith(' (stale)\n')
+
+
+def test_report_missing(tmpdir, capsys):
+    assert _snapshot.report(tmpdir.join('status').strpath) \
+        == errno.ENOENT
+    _, err = capsys.readouterr()
+    assert 'No status snapshot found' in err
+
+
+def test_status_fast_path(snapshot, tmpdir):
+    env = dict(os.environ, XDG_CACHE_HOME=tmpdir.strpath)
+    os.rename(snapshot[0], tmpdir.mkdir('blanco').join('status'))
+    script = ('import sys, blanco; sys.argv[1:] = ["--status"]; '
+              'code = blanco.run(); '
+              'print(sorted({"click", "parse", "notify2", "blanco._core"} '
+              '& set(sys.modules))); '
+              'sys.exit(code)')
+    proc = subprocess.run([sys.executable, '-c', script],
+                          env=env,
+                          stdout=subprocess.PIPE,
+                          universal_newlines=True,
+                          check=True)
+    assert proc.stdout.splitlines()[1] == '[]'
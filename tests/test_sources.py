@@ -0,0 +1,339 @@
+#
+"""test_sources - Test sent source backend registry"""
+# Copyright © 2010-2014  James Rowe <jnrowe@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import shutil
+import subprocess
+import sys
+from datetime import date
+from importlib import metadata
+from pathlib import Path
+
+from click import BadParameter
+from pytest import (fixture, mark, raises)
+
+from blanco import (Deadline, Position, SentRecord, SentSource, _core,
+                    _sources, available_sources, load_source, parse_msmtp,
+                    parse_sent)
+
+
+class FakeSource(SentSource):
+    location_key = 'fake'
+
+    def records(self, all_recipients=False, addresses=None):
+        return iter([
+            SentRecord('joe@example.com', date(2000, 2, 9), 1),
+            SentRecord('joe@example.com', date(2010, 2, 9), 2),
+        ])
+
+
+class CountdownDeadline(Deadline):
+    """Deadline that expires after a number of checks."""
+
+    def __init__(self, checks: int):
+        super().__init__(60)
+        self.checks = checks
+
+    def check(self) -> bool:
+        self.checks -= 1
+        if self.checks < 0:
+            self.expired = True
+        return self.expired
+
+
+class FakeEntryPoints(list):
+    def select(self, group):
+        return [e for e in self if e.group == group]
+
+
+@fixture
+def plugin(monkeypatch):
+    entry_point = metadata.EntryPoint('fake', 'tests.test_sources:FakeSource',
+                                      _sources.ENTRY_POINT_GROUP)
+    monkeypatch.setattr(metadata, 'entry_points',
+                        lambda: FakeEntryPoints([entry_point]))
+    available_sources.cache_clear()
+    yield
+    available_sources.cache_clear()
+
+
+def test_available_sources():
+    assert {'imap', 'mailbox', 'msmtp'} <= set(available_sources())
+
+
+def test_load_source_unknown():
+    with raises(ValueError) as err:
+        load_source('carrier pigeon')
+    assert str(err.value) == 'Unknown sent source type ‘carrier pigeon’'
+
+
+def test_plugin(plugin):
+    assert 'fake' in available_sources()
+    source = _sources.open_source('fake', {'fake': '~/sent'})
+    assert source.location == Path('~/sent').expanduser()
+    assert source.read() == {'joe@example.com': date(2010, 2, 9)}
+
+
+@mark.parametrize('name, options, expected', [
+    ('mailbox', {'mbox': 'tests/data/sent.mh'},
+     parse_sent(Path('tests/data/sent.mh'), True)),
+    ('msmtp', {'log': 'tests/data/sent_gmail.msmtp', 'gmail': True},
+     parse_msmtp(Path('tests/data/sent_gmail.msmtp'), True, gmail=True)),
+])
+def test_open_source(name, options, expected):
+    source = _sources.open_source(name, options)
+    assert source.read(True) == expected
+    records = list(source.records(True))
+    assert {r.address for r in records} == set(expected)
+
+
+def test_identity():
+    a = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.maildir'})
+    b = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.maildir/'})
+    c = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.maildir',
+                                         'mh sequence': 'blanco'})
+    assert a.identity() == b.identity() != c.identity()
+
+
+def test_capabilities():
+    assert load_source('mailbox').capabilities.parallel is True
+    assert load_source('msmtp').capabilities.incremental is False
+    assert load_source('imap').capabilities.ordering is None
+    assert load_source('imap').capabilities.bounded is False
+
+
+def test_deadline():
+    assert Deadline(0).check() is True
+    deadline = Deadline(60)
+    assert deadline.check() is False
+    assert deadline.expired is False
+
+
+@mark.parametrize('name, options', [
+    ('mailbox', {'mbox': 'tests/data/sent.mbox'}),
+    ('mailbox', {'mbox': 'tests/data/sent.maildir'}),
+    ('mailbox', {'mbox': 'tests/data/sent.mh', 'read ahead': 2}),
+    ('msmtp', {'log': 'tests/data/sent.msmtp', 'gmail': False}),
+    ('msmtp', {'log': 'tests/data/sent_gmail.msmtp', 'gmail': True}),
+])
+def test_newest_records(name, options):
+    source = _sources.open_source(name, options)
+    records = list(source.records(True))
+    newest = list(source.newest_records(True))
+    # Positions differ for logs, line numbers forwards and offsets backwards
+    assert sorted(r[:2] for r in newest) == sorted(r[:2] for r in records)
+    positions = [r.position for r in newest]
+    assert positions == sorted(positions, reverse=True)
+    # Ranges exclude their boundaries
+    middle = newest[len(newest) // 2]
+    boundary = Position(middle.position, middle.date)
+    assert list(source.newest_records(True, after=boundary)) \
+        + list(source.newest_records(True, before=boundary)) \
+        == [r for r in newest if r.position != middle.position]
+
+
+def test_newest_records_deadline():
+    source = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.mh'})
+    deadline = CountdownDeadline(1)
+    records = list(source.newest_records(True, deadline=deadline))
+    assert {r.position for r in records} == {3}
+    assert deadline.first == deadline.last == Position(3)
+
+
+@mark.parametrize('name, options', [
+    ('mailbox', {'mbox': 'sent.mh'}),
+    ('msmtp', {'log': 'sent_gmail.msmtp', 'gmail': True}),
+])
+def test_scan_resume(name, options, tmpdir):
+    key = next(iter(options))
+    location = tmpdir.join('sent').strpath
+    data = Path('tests/data', options[key])
+    if data.is_dir():
+        shutil.copytree(data, location)
+    else:
+        shutil.copy(data, location)
+    source = _sources.open_source(name, dict(options, **{key: location}))
+    checkpoint = Path(tmpdir.join('checkpoint'))
+    expected = source.read(True)
+
+    deadline = CountdownDeadline(1)
+    partial = _sources.scan(source, True, None, deadline, checkpoint)
+    assert deadline.expired
+    assert 0 < len(partial) < len(expected)
+
+    deadline = CountdownDeadline(100)
+    assert _sources.scan(source, True, None, deadline, checkpoint) == expected
+    assert not deadline.expired
+
+    # Completed scans only read new mail
+    deadline = CountdownDeadline(100)
+    assert _sources.scan(source, True, None, deadline, checkpoint) == expected
+    assert deadline.checks == 100
+
+
+def test_scan_filtered_resume(tmpdir):
+    source = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.mh'})
+    checkpoint = Path(tmpdir.join('checkpoint'))
+    # Only the oldest message matches, so the early runs find nothing but
+    # must still move forward
+    runs = 0
+    deadline = CountdownDeadline(1)
+    while not runs or deadline.expired:
+        deadline = CountdownDeadline(1)
+        sent = _sources.scan(source, True, ['test@example.com'], deadline,
+                             checkpoint)
+        assert checkpoint.exists()
+        runs += 1
+    assert runs == 3
+    assert sent == source.read(True, ['test@example.com'])
+
+
+def _log_entry(recipient: str, timestamp: int) -> str:
+    return (f'Feb 10 12:13:47 host=smtp.example.com tls=on auth=on '
+            f'from=jnrowe@example.com recipients={recipient} mailsize=1 '
+            f'smtpstatusmsg=\'250 2.0.0 OK {timestamp} q5sm\' '
+            'exitcode=EX_OK\n')
+
+
+def test_scan_new_mail_partial(tmpdir):
+    log = tmpdir.join('sent.msmtp')
+    shutil.copy('tests/data/sent_gmail.msmtp', log.strpath)
+    source = _sources.open_source('msmtp', {'log': log.strpath, 'gmail': True})
+    checkpoint = Path(tmpdir.join('checkpoint'))
+    _sources.scan(source, True, None, Deadline(60), checkpoint)
+    log.write(_log_entry('new@example.com', 1265890000)
+              + _log_entry('newer@example.com', 1265990000), mode='a')
+    deadline = CountdownDeadline(1)
+    sent = _sources.scan(source, True, None, deadline, checkpoint)
+    assert deadline.expired
+    assert 'newer@example.com' in sent
+    assert 'new@example.com' not in sent
+    # Only the unread new entry is left
+    deadline = CountdownDeadline(100)
+    sent = _sources.scan(source, True, None, deadline, checkpoint)
+    assert deadline.checks == 99
+    assert sent == source.read(True)
+
+
+def test_scan_new_mail(tmpdir):
+    log = tmpdir.join('sent.msmtp')
+    shutil.copy('tests/data/sent_gmail.msmtp', log.strpath)
+    source = _sources.open_source('msmtp', {'log': log.strpath, 'gmail': True})
+    checkpoint = Path(tmpdir.join('checkpoint'))
+    _sources.scan(source, True, None, Deadline(60), checkpoint)
+    log.write(_log_entry('new@example.com', 1265890000), mode='a')
+    deadline = CountdownDeadline(100)
+    sent = _sources.scan(source, True, None, deadline, checkpoint)
+    assert deadline.checks == 99
+    assert sent['new@example.com'] == date(2010, 2, 11)
+    assert sent == source.read(True)
+
+
+@mark.parametrize('entries', [1, 20])
+def test_scan_rotated_log(entries: int, tmpdir):
+    log = tmpdir.join('sent.msmtp')
+    shutil.copy('tests/data/sent_gmail.msmtp', log.strpath)
+    source = _sources.open_source('msmtp', {'log': log.strpath, 'gmail': True})
+    checkpoint = Path(tmpdir.join('checkpoint'))
+    _sources.scan(source, True, None, Deadline(60), checkpoint)
+    log.write(''.join(_log_entry(f'new{n}@example.com', 1265890000 + n)
+                      for n in range(entries)))
+    sent = _sources.scan(source, True, None, Deadline(60), checkpoint)
+    assert f'new{entries - 1}@example.com' in sent
+    assert sent == source.read(True)
+
+
+def test_scan_renumbered_mh(tmpdir):
+    path = tmpdir.join('sent.mh')
+    shutil.copytree('tests/data/sent.mh', path.strpath)
+    source = _sources.open_source('mailbox', {'mbox': path.strpath})
+    checkpoint = Path(tmpdir.join('checkpoint'))
+    _sources.scan(source, True, None, Deadline(60), checkpoint)
+    # As ``folder -pack`` would after the first message is removed, and then
+    # new mail arrives
+    path.join('1').remove()
+    path.join('2').rename(path.join('1'))
+    path.join('3').rename(path.join('2'))
+    path.join('3').write('To: new@example.com\n'
+                         'Date: Wed, 10 Feb 2010 12:13:47 +0000\n\n')
+    sent = _sources.scan(source, True, None, Deadline(60), checkpoint)
+    assert sent['new@example.com'] == date(2010, 2, 10)
+    assert sent == source.read(True)
+
+
+def test_fingerprint(tmpdir):
+    log = tmpdir.join('sent.msmtp')
+    shutil.copy('tests/data/sent_gmail.msmtp', log.strpath)
+    msmtp = _sources.open_source('msmtp', {'log': log.strpath})
+    assert msmtp.fingerprint(0) == msmtp.fingerprint(0)
+    assert msmtp.fingerprint(0) != msmtp.fingerprint(log.size() // 2)
+    assert msmtp.fingerprint(log.size()) is None
+    mh = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.mh'})
+    assert mh.fingerprint(1) != mh.fingerprint(2)
+    assert mh.fingerprint(4) is None
+    mbox = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.mbox'})
+    assert mbox.fingerprint(0) is not None
+    assert mbox.fingerprint(100) is None
+
+
+def test_scan_no_checkpoint():
+    source = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.mh'})
+    assert _sources.scan(source, True, None, Deadline(60)) \
+        == source.read(True)
+
+
+def test_checkpoint_path(monkeypatch, tmpdir):
+    monkeypatch.setenv('XDG_CACHE_HOME', tmpdir.strpath)
+    source = _sources.open_source('mailbox', {'mbox': 'tests/data/sent.mh'})
+    path = _sources.checkpoint_path(source, True, ['b', 'a'])
+    assert path.parent == Path(tmpdir.join('blanco', 'checkpoints'))
+    assert path == _sources.checkpoint_path(source, True, ['a', 'b'])
+    assert path != _sources.checkpoint_path(source, False, ['a', 'b'])
+
+
+@mark.parametrize('name, imported, avoided', [
+    ('mailbox', 'blanco._mailbox', 'parse'),
+    ('msmtp', 'parse', 'blanco._mailbox'),
+])
+def test_lazy_loading(name: str, imported: str, avoided: str):
+    script = ('import sys; from blanco import _core; '
+              f'_core.load_source({name!r}); '
+              f'print({imported!r} in sys.modules, '
+              f'{avoided!r} in sys.modules)')
+    proc = subprocess.run([sys.executable, '-c', script],
+                          stdout=subprocess.PIPE,
+                          universal_newlines=True,
+                          check=True)
+    assert proc.stdout.split() == ['True', 'False']
+
+
+def test_source_choice(monkeypatch):
+    calls = []
+
+    def counting_available_sources():
+        calls.append(True)
+        return {'mailbox': 'x', 'imap': 'y'}
+
+    monkeypatch.setattr(_core, 'available_sources',
+                        counting_available_sources)
+    choice = _core._SourceChoice()
+    assert not calls
+    assert choice.convert('imap', None, None) == 'imap'
+    with raises(BadParameter):
+        choice.convert('pop3', None, None)
+    assert choice.choices == ('imap', 'mailbox')
+    assert len(calls) == 1